@@ -2,23 +2,29 @@ import sublime
 import sublime_plugin
 import fnmatch
 import os
-import re
 import shutil
+import threading
+import time
 
-from .gotools_util import Buffers
+from .gotools_util import BuildConstraints
 from .gotools_util import GoBuffers
 from .gotools_util import Logger
+from .gotools_util import OutputPanel
 from .gotools_util import ToolRunner
+from .gotools_test_binary import TestBinaryCache
 from .gotools_settings import GoToolsSettings
 
 class GotoolsBuildCommand(sublime_plugin.WindowCommand):
+  # window id -> (cmd, packages) of the last test run, for test watch mode.
+  last_tests = {}
+
   def run(self, cmd = None, shell_cmd = None, file_regex = "", line_regex = "", working_dir = "",
           encoding = "utf-8", env = {}, quiet = False, kill = False,
           word_wrap = True, syntax = "Packages/Text/Plain text.tmLanguage",
           clean = False, task = "build",
           # Catches "path" and "shell"
           **kwargs):
-    if clean:
+    if clean is True:
       self.clean()
 
     if len(file_regex) == 0:
@@ -42,6 +48,16 @@ class GotoolsBuildCommand(sublime_plugin.WindowCommand):
       "syntax": syntax,
       }
 
+    # Selective cleans can take a while on a large GOPATH, so they run in the
+    # background and start the task once they're done.
+    if clean in ["stale", "stale_project"]:
+      project_only = clean == "stale_project"
+      threading.Thread(target=self.clean_stale_then_run, args=(project_only, task, exec_opts)).start()
+      return
+
+    self.run_task(task, exec_opts)
+
+  def run_task(self, task, exec_opts):
     if task == "build":
       self.build(exec_opts)
     elif task == "test_packages":
@@ -57,13 +73,16 @@ class GotoolsBuildCommand(sublime_plugin.WindowCommand):
       self.test_current_package(exec_opts)
     elif task == "test_last":
       Logger.log("re-running last test")
+      if getattr(self, "last_test_binary_args", None):
+        self.start_test_binary(self.last_test_exec_opts, *self.last_test_binary_args)
+        return
       self.window.run_command("exec", self.last_test_exec_opts)
     else:
       Logger.log("invalid task: " + task)
 
   def clean(self):
     Logger.log("cleaning build output directories")
-    for p in GoToolsSettings.get().gopath.split(":"):
+    for p in GoToolsSettings.get().gopath_entries:
       pkgdir = os.path.join(p, "pkg", GoToolsSettings.get().goos + "_" + GoToolsSettings.get().goarch)
       Logger.log("=> " + pkgdir)
       if os.path.exists(pkgdir):
@@ -72,6 +91,59 @@ class GotoolsBuildCommand(sublime_plugin.WindowCommand):
         except Exception as e:
           Logger.log("WARNING: couldn't clean directory: " + str(e))
 
+  def clean_stale_then_run(self, project_only, task, exec_opts):
+    self.clean_stale(project_only)
+    sublime.set_timeout(lambda: self.run_task(task, exec_opts), 0)
+
+  # Removes only the package archives which are older than their sources (or
+  # whose sources no longer exist), optionally limited to project_package, so
+  # the next build recompiles just what changed.
+  def clean_stale(self, project_only=False):
+    Logger.log("cleaning stale package archives")
+    start = time.time()
+    kept = removed = kept_bytes = removed_bytes = 0
+    for p in GoToolsSettings.get().gopath_entries:
+      pkgdir = os.path.join(p, "pkg", GoToolsSettings.get().goos + "_" + GoToolsSettings.get().goarch)
+      root = pkgdir
+      if project_only:
+        root = os.path.join(pkgdir, GoToolsSettings.get().project_package)
+      Logger.log("=> " + root)
+      for dirpath, dirnames, filenames in os.walk(root):
+        for filename in fnmatch.filter(filenames, '*.a'):
+          archive = os.path.join(dirpath, filename)
+          import_path = os.path.relpath(archive, pkgdir)[:-len('.a')]
+          try:
+            size = os.path.getsize(archive)
+            if self.archive_is_stale(archive, os.path.join(p, "src", import_path)):
+              os.remove(archive)
+              removed += 1
+              removed_bytes += size
+            else:
+              kept += 1
+              kept_bytes += size
+          except OSError as e:
+            Logger.log("WARNING: couldn't clean archive: " + str(e))
+          if (kept + removed) % 200 == 0:
+            Logger.status("cleaning: checked {0} archives, removed {1}".format(kept + removed, removed))
+
+    elapsed = round(time.time() - start, 1)
+    Logger.log("stale clean finished in {0} seconds".format(elapsed))
+    Logger.status("clean: removed {0} stale archives ({1:.1f} MB), kept {2} ({3:.1f} MB)".format(
+      removed, removed_bytes / 1048576.0, kept, kept_bytes / 1048576.0))
+
+  @staticmethod
+  def archive_is_stale(archive, src_dir):
+    if not os.path.isdir(src_dir):
+      return True
+    built = os.path.getmtime(archive)
+    if os.path.getmtime(src_dir) > built:
+      return True
+    for filename in os.listdir(src_dir):
+      if filename.endswith(".go") and not filename.endswith("_test.go"):
+        if os.path.getmtime(os.path.join(src_dir, filename)) > built:
+          return True
+    return False
+
 
   def build(self, exec_opts):
     build_packages = []
@@ -112,8 +184,45 @@ class GotoolsBuildCommand(sublime_plugin.WindowCommand):
 
     # Cache the execution for easy recall
     self.last_test_exec_opts = exec_opts
+    self.last_test_binary_args = None
+    GotoolsBuildCommand.last_tests[self.window.id()] = (cmd, packages)
+
+    if GoToolsSettings.get().test_binary_cache and len(packages) == 1:
+      self.last_test_binary_args = (packages[0], patterns, tags)
+      self.start_test_binary(exec_opts, packages[0], patterns, tags)
+      return
+
     self.window.run_command("exec", exec_opts)
 
+  def start_test_binary(self, exec_opts, pkg, patterns, tags):
+    threading.Thread(target=self.run_test_binary, args=(dict(exec_opts), pkg, patterns, tags)).start()
+
+  # Runs the tests of pkg from a cached test binary, compiling it first only
+  # if the package or its dependencies changed since it was built.
+  def run_test_binary(self, exec_opts, pkg, patterns, tags):
+    try:
+      binary, pkg_dir = TestBinaryCache.get(pkg, tags)
+    except Exception as e:
+      Logger.status("couldn't compile tests for " + pkg)
+      panel = OutputPanel(self.window, 'gotools_test_build', exec_opts["file_regex"])
+      panel.append(str(e))
+      panel.flush()
+      panel.show()
+      return
+
+    cmd = [binary]
+    if GoToolsSettings.get().verbose_tests:
+      cmd.append("-test.v")
+    if GoToolsSettings.get().test_timeout:
+      cmd += ["-test.timeout", GoToolsSettings.get().test_timeout]
+    for p in patterns:
+      cmd += ["-test.run", "^"+p+"$"]
+
+    # go test runs test binaries from the package directory.
+    exec_opts["cmd"] = cmd
+    exec_opts["working_dir"] = pkg_dir
+    sublime.set_timeout(lambda: self.window.run_command("exec", exec_opts), 0)
+
   def test_current_package(self, exec_opts):
     Logger.log("running current package tests")
     view = self.window.active_view()
@@ -149,7 +258,8 @@ class GotoolsBuildCommand(sublime_plugin.WindowCommand):
     Logger.log("running test: " + pkg + "#" + func_name)
     self.test_packages(exec_opts=exec_opts, packages=[pkg], patterns=[func_name], tags=tags)
 
-  def current_file_pkg(self, view):
+  @staticmethod
+  def current_file_pkg(view):
     abs_pkg_dir = os.path.dirname(view.file_name())
     try:
       return abs_pkg_dir[abs_pkg_dir.index(GoToolsSettings.get().project_package):]
@@ -157,13 +267,7 @@ class GotoolsBuildCommand(sublime_plugin.WindowCommand):
       return ""
 
   def find_test_packages(self):
-    proj_package_dir = None
-
-    for gopath in GoToolsSettings.get().gopath.split(":"):
-      d = os.path.join(gopath, "src", GoToolsSettings.get().project_package)
-      if os.path.exists(d):
-        proj_package_dir = d
-        break
+    proj_package_dir = GoToolsSettings.get().project_package_dir
 
     if proj_package_dir == None:
       Logger.log("ERROR: couldn't find project package dir '"
@@ -186,16 +290,8 @@ class GotoolsBuildCommand(sublime_plugin.WindowCommand):
 
   @staticmethod
   def tags_for_buffer(view):
-    # TODO: Use a sane way to get the first line of the buffer
-    header = Buffers.buffer_text(view).decode("utf-8").splitlines()[0]
-
-    found_tags = []
-    match = re.match('\/\/\ \+build\ (.*)', header)
-    if match and match.group(1):
-      tags = match.group(1)
-      tags = tags.split(',')
-      for tag in tags:
-        if not tag.startswith('!'):
-          found_tags.append(tag)
-    
-    return found_tags
+    # go test reads the file from disk, so the package index is only bypassed
+    # for unsaved changes.
+    if view.is_dirty() or not view.file_name():
+      return BuildConstraints.tags_for_view(view)
+    return BuildConstraints.tags_for_file(view.file_name())
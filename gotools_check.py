@@ -0,0 +1,112 @@
+import sublime
+import sublime_plugin
+import os
+import re
+import threading
+
+from .gotools_util import Buffers
+from .gotools_util import GoBuffers
+from .gotools_util import Logger
+from .gotools_util import ToolRunner
+from .gotools_settings import GoToolsSettings
+
+# Compiles (and optionally vets) the package of a saved file in the background
+# and marks the reported errors in every open view of that package. Only one
+# check runs at a time: a newer save cancels the check in flight.
+class PackageChecker():
+  ERROR_RE = re.compile(r'^(.*?\.go):(\d+)(?::\d+)?: (.*)$')
+  REGION_KEY = "gotools_check"
+
+  lock = threading.Lock()
+  generation = 0
+  current = None
+  # file -> {row: message} from the most recent check of its package.
+  errors = {}
+
+  @staticmethod
+  def schedule(view):
+    pkg_dir = os.path.dirname(view.file_name())
+    with PackageChecker.lock:
+      PackageChecker.generation += 1
+      generation = PackageChecker.generation
+      stream = PackageChecker.current
+    if stream:
+      stream.cancel()
+    sublime.set_timeout(lambda: PackageChecker.start(pkg_dir, generation), GoToolsSettings.get().check_on_save_delay)
+
+  @staticmethod
+  def start(pkg_dir, generation):
+    if generation != PackageChecker.generation:
+      return
+    threading.Thread(target=PackageChecker.check, args=(pkg_dir, generation)).start()
+
+  @staticmethod
+  def check(pkg_dir, generation):
+    commands = [["build", "-o", os.devnull, "."]]
+    if GoToolsSettings.get().check_vet:
+      commands.append(["vet", "."])
+
+    Logger.status("checking " + pkg_dir + "...")
+    output = []
+    for args in commands:
+      with PackageChecker.lock:
+        if generation != PackageChecker.generation:
+          return
+        try:
+          stream = ToolRunner.stream("go", args, timeout=60, merge_stderr=True, cwd=pkg_dir)
+        except Exception as e:
+          Logger.error("package check failed: " + str(e))
+          return
+        PackageChecker.current = stream
+      output.extend(stream)
+      if stream.cancelled:
+        return
+
+    errors = {}
+    for line in output:
+      match = PackageChecker.ERROR_RE.match(line.rstrip())
+      if not match:
+        continue
+      filename = os.path.normpath(os.path.join(pkg_dir, match.group(1)))
+      errors.setdefault(filename, {}).setdefault(int(match.group(2)), match.group(3))
+
+    sublime.set_timeout(lambda: PackageChecker.show(pkg_dir, errors), 0)
+
+  @staticmethod
+  def show(pkg_dir, errors):
+    for filename in list(PackageChecker.errors):
+      if os.path.dirname(filename) == pkg_dir:
+        del PackageChecker.errors[filename]
+    PackageChecker.errors.update(errors)
+
+    for window in sublime.windows():
+      for view in window.views():
+        if view.file_name() and os.path.dirname(view.file_name()) == pkg_dir:
+          Buffers.mark_error_rows(view, PackageChecker.REGION_KEY, errors.get(view.file_name(), {}).keys())
+
+    count = sum(len(rows) for rows in errors.values())
+    if count > 0:
+      Logger.status("{0} error(s) in {1}".format(count, pkg_dir))
+    else:
+      Logger.status("check passed for " + pkg_dir)
+
+class GotoolsCheckOnSave(sublime_plugin.EventListener):
+  def on_post_save_async(self, view):
+    if not GoBuffers.is_go_source(view): return
+    if not GoToolsSettings.get().check_on_save: return
+    PackageChecker.schedule(view)
+
+  # Marks are per view, so views opened after a check need them restored.
+  def on_load(self, view):
+    errors = PackageChecker.errors.get(view.file_name())
+    if errors:
+      Buffers.mark_error_rows(view, PackageChecker.REGION_KEY, errors.keys())
+
+  # Show the error for the line under the cursor.
+  def on_selection_modified(self, view):
+    errors = PackageChecker.errors.get(view.file_name())
+    if not errors or len(view.sel()) == 0:
+      return
+    row = view.rowcol(view.sel()[0].begin())[0] + 1
+    if row in errors:
+      Logger.status(errors[row])
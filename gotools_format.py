@@ -1,10 +1,20 @@
 import sublime
 import sublime_plugin
+import concurrent.futures
+import hashlib
+import json
+import os
 import re
+import shutil
+import tempfile
+import threading
+import time
 
 from .gotools_util import Buffers
 from .gotools_util import GoBuffers
 from .gotools_util import Logger
+from .gotools_util import MemoryTrace
+from .gotools_util import OutputPanel
 from .gotools_util import ToolRunner
 from .gotools_settings import GoToolsSettings
 
@@ -12,6 +22,9 @@ class GotoolsFormatOnSave(sublime_plugin.EventListener):
   def on_pre_save(self, view):
     if not GoBuffers.is_go_source(view): return
     if not GoToolsSettings.get().format_on_save: return
+    # Set while gotools_format_project saves a buffer it just formatted.
+    if view.settings().get("gotools_skip_format"):
+      return
     view.run_command('gotools_format')
 
 class GotoolsFormat(sublime_plugin.TextCommand):
@@ -19,34 +32,11 @@ class GotoolsFormat(sublime_plugin.TextCommand):
     return GoBuffers.is_go_source(self.view)
 
   def run(self, edit):
-    command = ""
-    args = []
-    if GoToolsSettings.get().format_backend == "gofmt":
-      command = "gofmt"
-      args = ["-e", "-s"]
-    elif GoToolsSettings.get().format_backend in ["goimports", "both"] :
-      command = "goimports"
-      args = ["-e"]
+    with MemoryTrace("format " + str(self.view.file_name())):
+      self.format(edit)
 
-    stdout, stderr, rc = ToolRunner.run(command, args, stdin=Buffers.buffer_text(self.view))
-
-    # Clear previous syntax error marks
-    self.view.erase_regions("mark")
-
-    if rc == 2:
-      # Show syntax errors and bail
-      self.show_syntax_errors(stderr)
-      return
-
-    if rc != 0:
-      # Ermmm...
-      Logger.log("unknown gofmt error (" + str(rc) + ") stderr:\n" + stderr)
-      return
-
-    if GoToolsSettings.get().format_backend == "both":
-      command = "gofmt"
-      args = ["-e", "-s"]
-      stdout, stderr, rc = ToolRunner.run(command, args, stdin=stdout.encode('utf-8'))
+  def format(self, edit):
+    stdout, stderr, rc = GotoolsFormat.format_source(Buffers.buffer_stdin(self.view))
 
     # Clear previous syntax error marks
     self.view.erase_regions("mark")
@@ -74,6 +64,31 @@ class GotoolsFormat(sublime_plugin.TextCommand):
     # Restore the viewport on the main GUI thread (which is the only way this works).
     sublime.set_timeout(self.restore_viewport, 0)
 
+  # Runs the configured format_backend over source (bytes, or chunks from
+  # Buffers.buffer_stdin). Returns the output, stderr and return code of the
+  # last tool which ran; the output is bytes unless decode is set.
+  @staticmethod
+  def format_source(source, decode=True):
+    command = ""
+    args = []
+    if GoToolsSettings.get().format_backend == "gofmt":
+      command = "gofmt"
+      args = ["-e", "-s"]
+    elif GoToolsSettings.get().format_backend in ["goimports", "both"] :
+      command = "goimports"
+      args = ["-e"]
+
+    both = GoToolsSettings.get().format_backend == "both"
+    # With both, goimports output goes straight to gofmt without decoding.
+    stdout, stderr, rc = ToolRunner.run(command, args, stdin=source, decode=decode and not both)
+
+    if rc == 0 and both:
+      command = "gofmt"
+      args = ["-e", "-s"]
+      stdout, stderr, rc = ToolRunner.run(command, args, stdin=stdout, decode=decode)
+
+    return stdout, stderr, rc
+
   def restore_viewport(self):
     self.view.set_viewport_position(self.prev_viewport_pos, False)
 
@@ -89,7 +104,7 @@ class GotoolsFormat(sublime_plugin.TextCommand):
     output_view.run_command('append', {'characters': syntax_output})
     self.view.window().run_command("show_panel", {"panel": "output.gotools_syntax_errors"})
 
-    marks = []
+    rows = []
     for error in stderr.splitlines():
       match = re.match("(.*):(\d+):(\d+):", error)
       if not match or not match.group(2):
@@ -97,9 +112,153 @@ class GotoolsFormat(sublime_plugin.TextCommand):
         continue
 
       row = int(match.group(2))
-      pt = self.view.text_point(row-1, 0)
       Logger.log("adding mark at row " + str(row))
-      marks.append(sublime.Region(pt))
+      rows.append(row)
+
+    Buffers.mark_error_rows(self.view, "mark", rows)
+
+# Replaces the whole buffer with text, keeping the viewport in place.
+class GotoolsReplaceBuffer(sublime_plugin.TextCommand):
+  def run(self, edit, text):
+    self.prev_viewport_pos = self.view.viewport_position()
+    self.view.replace(edit, sublime.Region(0, self.view.size()), text)
+    sublime.set_timeout(lambda: self.view.set_viewport_position(self.prev_viewport_pos, False), 0)
+
+# Remembers a hash of the last output produced for each file by each format
+# backend, so files which haven't changed since can be skipped.
+class FormatCache():
+  def __init__(self, backend):
+    self.backend = backend
+    self.lock = threading.Lock()
+    self.path = os.path.join(sublime.cache_path(), "GoTools", "format-cache.json")
+    self.data = {}
+    try:
+      with open(self.path, encoding="utf-8") as f:
+        self.data = json.load(f)
+    except (OSError, ValueError):
+      pass
+    self.hashes = self.data.setdefault(backend, {})
+
+  def is_formatted(self, path, source):
+    return self.hashes.get(path) == hashlib.sha1(source).hexdigest()
+
+  def put(self, path, output):
+    with self.lock:
+      self.hashes[path] = hashlib.sha1(output).hexdigest()
+
+  def save(self):
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+      json.dump(self.data, f)
+    os.replace(self.path + ".tmp", self.path)
+
+# Formats every Go file under project_package (or the directories selected in
+# the sidebar) with format_backend, using a pool of format_workers threads.
+# Files open in a view are formatted from the view and updated in place;
+# other files are rewritten atomically.
+class GotoolsFormatProjectCommand(sublime_plugin.WindowCommand):
+  def run(self, dirs=[]):
+    roots = dirs
+    if len(roots) == 0:
+      project_dir = GoToolsSettings.get().project_package_dir
+      if project_dir is None:
+        Logger.status("couldn't find project package '{0}' in GOPATH".format(GoToolsSettings.get().project_package))
+        return
+      roots = [project_dir]
+
+    # Snapshot open views on the main thread.
+    views = {}
+    for window in sublime.windows():
+      for view in window.views():
+        if view.file_name() and view.file_name().endswith(".go"):
+          views[view.file_name()] = (view, view.change_count(), view.is_dirty(),
+            view.substr(sublime.Region(0, view.size())).encode("utf-8"))
+
+    threading.Thread(target=self.format_all, args=(roots, views)).start()
+
+  def format_all(self, roots, views):
+    start = time.time()
+    files = []
+    for root in roots:
+      for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not (d.startswith(".") or d.startswith("_") or d == "testdata")]
+        files += [os.path.join(dirpath, f) for f in filenames if f.endswith(".go")]
+
+    panel = OutputPanel(self.window, 'gotools_format_project', "^(.*\\.go):(\\d+):(\\d+): (.*)$")
+    panel.show()
+    panel.append("formatting {0} files with {1}\n".format(len(files), GoToolsSettings.get().format_backend))
+
+    cache = FormatCache(GoToolsSettings.get().format_backend)
+    counts = {"formatted": 0, "unchanged": 0, "skipped": 0, "failed": 0}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=GoToolsSettings.get().format_workers) as pool:
+      futures = {pool.submit(self.format_file, path, views.get(path), cache): path for path in files}
+      for future in concurrent.futures.as_completed(futures):
+        path = futures[future]
+        try:
+          result, elapsed, detail = future.result()
+        except Exception as e:
+          result, elapsed, detail = "failed", 0, str(e) + "\n"
+        counts[result] += 1
+        if result != "skipped":
+          panel.append("{0}: {1} in {2}ms\n".format(path, result, elapsed))
+        if detail:
+          panel.append(detail)
+    cache.save()
+
+    summary = "{formatted} formatted, {unchanged} unchanged, {skipped} skipped, {failed} failed".format(**counts)
+    elapsed = round(time.time() - start, 1)
+    panel.append("{0} in {1} seconds\n".format(summary, elapsed))
+    panel.flush()
+    Logger.status("format project: " + summary)
+
+  # Returns (result, elapsed milliseconds, detail) for one file.
+  def format_file(self, path, view_state, cache):
+    start = time.time()
+    if view_state:
+      source = view_state[3]
+    else:
+      with open(path, "rb") as f:
+        source = f.read()
+
+    if cache.is_formatted(path, source):
+      return ("skipped", 0, None)
+
+    output, stderr, rc = GotoolsFormat.format_source(source, decode=False)
+    elapsed = round((time.time() - start) * 1000)
+    if rc != 0:
+      return ("failed", elapsed, stderr.replace("<standard input>", path))
+
+    cache.put(path, output)
+    if output == source:
+      return ("unchanged", elapsed, None)
+
+    if view_state:
+      text = output.decode("utf-8")
+      sublime.set_timeout(lambda: self.update_view(view_state, text), 0)
+    else:
+      self.write_atomic(path, output)
+    return ("formatted", elapsed, None)
+
+  @staticmethod
+  def update_view(view_state, text):
+    view, change_count, was_dirty, _ = view_state
+    if view.change_count() != change_count:
+      Logger.log("not formatting {0}: buffer changed while formatting".format(view.file_name()))
+      return
+    view.run_command("gotools_replace_buffer", {"text": text})
+    if not was_dirty:
+      view.settings().set("gotools_skip_format", True)
+      view.run_command("save")
+      view.settings().erase("gotools_skip_format")
 
-    if len(marks) > 0:
-      self.view.add_regions("mark", marks, "mark", "dot", sublime.DRAW_STIPPLED_UNDERLINE | sublime.PERSISTENT)
+  @staticmethod
+  def write_atomic(path, data):
+    tmp = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=".gotools-", delete=False)
+    try:
+      with tmp:
+        tmp.write(data)
+      shutil.copymode(path, tmp.name)
+      os.replace(tmp.name, path)
+    except Exception:
+      os.remove(tmp.name)
+      raise
@@ -7,6 +7,7 @@ from .gotools_util import Buffers
 from .gotools_util import GoBuffers
 from .gotools_util import Logger
 from .gotools_util import ToolRunner
+from .gotools_prefetch import OraclePrefetcher
 from .gotools_settings import GoToolsSettings
 
 class GotoolsGotoDef(sublime_plugin.TextCommand):
@@ -25,13 +26,15 @@ class GotoolsGotoDef(sublime_plugin.TextCommand):
     # cursor or mouse event location.
     if event:
       filename, row, col, offset = Buffers.location_for_event(self.view, event)
+      pt = self.view.window_to_text((event["x"], event["y"]))
     else:
       filename, row, col, offset, offset_end = Buffers.location_at_cursor(self.view)
+      pt = self.view.sel()[0].begin()
 
     backend = GoToolsSettings.get().goto_def_backend if GoToolsSettings.get().goto_def_backend else ""
     try:
       if backend == "oracle":
-        file, row, col = self.get_oracle_location(filename, offset)
+        file, row, col = self.get_oracle_location(filename, offset, pt)
       elif backend == "godef":
         file, row, col = self.get_godef_location(filename, offset)
       else:
@@ -54,26 +57,15 @@ class GotoolsGotoDef(sublime_plugin.TextCommand):
     if group != -1:
         w.focus_group(group)
 
-  def get_oracle_location(self, filename, offset):
-    args = ["-pos="+filename+":#"+str(offset), "-format=json", "definition"]
+  def get_oracle_location(self, filename, offset, pt):
+    location = OraclePrefetcher.lookup(self.view, "definition", pt)
+    if location is None:
+      args = OraclePrefetcher.oracle_args(filename, "definition", filename+":#"+str(offset), "json",
+        GoToolsSettings.get().package_scope)
 
-    # Build up a package scope contaning all packages the user might have
-    # configured.
-    # TODO: put into a utility
-    package_scope = []
-    for p in GoToolsSettings.get().build_packages:
-      package_scope.append(os.path.join(GoToolsSettings.get().project_package, p))
-    for p in GoToolsSettings.get().test_packages:
-      package_scope.append(os.path.join(GoToolsSettings.get().project_package, p))
-    for p in GoToolsSettings.get().tagged_test_packages:
-      package_scope.append(os.path.join(GoToolsSettings.get().project_package, p))
-
-    if len(package_scope) > 0:
-      args = args + package_scope
-
-    location, err, rc = ToolRunner.run("oracle", args)
-    if rc != 0:
-      raise Exception("no definition found")
+      location, err, rc = ToolRunner.run("oracle", args)
+      if rc != 0:
+        raise Exception("no definition found")
 
     Logger.log("oracle output:\n" + location.rstrip())
 
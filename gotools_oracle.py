@@ -1,14 +1,25 @@
 import sublime
 import sublime_plugin
+import collections
+import concurrent.futures
+import json
+import multiprocessing
 import os
+import re
+import time
 
+from .gotools_build import GotoolsBuildCommand
 from .gotools_util import Buffers
 from .gotools_util import GoBuffers
 from .gotools_util import Logger
+from .gotools_util import OutputPanel
 from .gotools_util import ToolRunner
+from .gotools_prefetch import OraclePrefetcher
 from .gotools_settings import GoToolsSettings
 
 class GotoolsOracleCommand(sublime_plugin.TextCommand):
+  SHARDED_MODES = ["callers", "implements", "referrers"]
+
   def is_enabled(self):
     return GoBuffers.is_go_source(self.view)
 
@@ -20,54 +31,286 @@ class GotoolsOracleCommand(sublime_plugin.TextCommand):
     filename, row, col, offset, offset_end = Buffers.location_at_cursor(self.view)
     pos = filename+":#"+str(offset)
 
-    # Build up a package scope contaning all packages the user might have
-    # configured.
-    # TODO: put into a utility
-    package_scope = []
-    for p in GoToolsSettings.get().build_packages:
-      package_scope.append(os.path.join(GoToolsSettings.get().project_package, p))
-    for p in GoToolsSettings.get().test_packages:
-      package_scope.append(os.path.join(GoToolsSettings.get().project_package, p))
-    for p in GoToolsSettings.get().tagged_test_packages:
-      package_scope.append(os.path.join(GoToolsSettings.get().project_package, p))
+    package_scope = GoToolsSettings.get().package_scope
 
     sublime.active_window().run_command("hide_panel", {"panel": "output.gotools_oracle"})
 
     if command == "callees":
-      sublime.set_timeout_async(lambda: self.do_plain_oracle("callees", pos, package_scope), 0)
+      sublime.set_timeout_async(lambda: self.do_structured_oracle("callees", pos, package_scope), 0)
     if command == "callers":
-      sublime.set_timeout_async(lambda: self.do_plain_oracle("callers", pos, package_scope), 0)
+      sublime.set_timeout_async(lambda: self.do_structured_oracle("callers", pos, package_scope), 0)
     if command == "callstack":
       sublime.set_timeout_async(lambda: self.do_plain_oracle("callstack", pos, package_scope), 0)
     if command == "describe":
-      sublime.set_timeout_async(lambda: self.do_plain_oracle("describe", pos, package_scope), 0)
+      pt = self.view.sel()[0].begin()
+      sublime.set_timeout_async(lambda: self.do_plain_oracle("describe", pos, package_scope, prefetch_pt=pt), 0)
     if command == "freevars":
       pos = filename+":#"+str(offset)+","+"#"+str(offset_end)
       sublime.set_timeout_async(lambda: self.do_plain_oracle("freevars", pos, package_scope), 0)
     if command == "implements":
-      sublime.set_timeout_async(lambda: self.do_plain_oracle("implements", pos, package_scope), 0)
+      sublime.set_timeout_async(lambda: self.do_structured_oracle("implements", pos, package_scope), 0)
     if command == "peers":
-      sublime.set_timeout_async(lambda: self.do_plain_oracle("peers", pos, package_scope), 0)
+      sublime.set_timeout_async(lambda: self.do_structured_oracle("peers", pos, package_scope), 0)
     if command == "referrers":
-      sublime.set_timeout_async(lambda: self.do_plain_oracle("referrers", pos, package_scope), 0)
+      sublime.set_timeout_async(lambda: self.do_structured_oracle("referrers", pos, package_scope), 0)
+
+  def do_plain_oracle(self, mode, pos, package_scope=[], regex="^(.*):(\d+):(\d+):(.*)$", prefetch_pt=None):
+    if prefetch_pt is not None:
+      output = OraclePrefetcher.lookup(self.view, mode, prefetch_pt)
+      if output is not None:
+        panel = self.plain_panel(regex)
+        panel.append(output)
+        panel.flush()
+        panel.show()
+        Logger.status("oracle "+mode+" finished (prefetched)")
+        return
 
-  def do_plain_oracle(self, mode, pos, package_scope=[], regex="^(.*):(\d+):(\d+):(.*)$"):
     Logger.status("running oracle "+mode+"...")
-    args = ["-pos="+pos, "-format=plain", mode]
-    if len(package_scope) > 0:
-      args = args + package_scope
-    output, err, rc = ToolRunner.run("oracle", args, timeout=60)
-    Logger.log("oracle "+mode+" output: " + output.rstrip())
-
-    if rc != 0:
-      Logger.status("oracle call failed (" + str(rc) +")")
+    args = self.oracle_args(mode, pos, "plain", package_scope)
+
+    panel = self.plain_panel(regex)
+    panel.show()
+    stream = ToolRunner.stream("oracle", args, timeout=60)
+    panel.follow(stream)
+
+    if stream.cancelled:
+      Logger.status("oracle "+mode+" cancelled")
+      return
+    if stream.returncode != 0:
+      panel.append(stream.stderr)
+      panel.flush()
+      Logger.status("oracle call failed (" + str(stream.returncode) +")")
       return
     Logger.status("oracle "+mode+" finished")
 
-    panel = self.view.window().create_output_panel('gotools_oracle')
-    panel.set_scratch(True)
-    panel.settings().set("result_file_regex", regex)
-    panel.run_command("select_all")
-    panel.run_command("right_delete")
-    panel.run_command('append', {'characters': output})
-    self.view.window().run_command("show_panel", {"panel": "output.gotools_oracle"})
+  # Returns the oracle panel for plain text output. The structured results
+  # panel reuses the same view, so its key bindings have to be turned off.
+  def plain_panel(self, regex=None):
+    panel = OutputPanel(self.view.window(), 'gotools_oracle', regex)
+    panel.view.settings().erase("gotools_oracle_results")
+    return panel
+
+  # Runs an oracle query with -format=json and shows the results in the
+  # structured results panel, which only renders the page being viewed. With
+  # oracle_shards set, queries in SHARDED_MODES are split by package scope
+  # and the shards run concurrently; see scope_shards.
+  def do_structured_oracle(self, mode, pos, package_scope=[]):
+    Logger.status("running oracle "+mode+"...")
+    start = time.time()
+    shards = self.scope_shards(mode, package_scope)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as pool:
+      runs = list(pool.map(lambda scope: self.run_shard(mode, pos, scope), shards))
+
+    if any(stream.cancelled for stream, _ in runs):
+      Logger.status("oracle "+mode+" cancelled")
+      return
+    failed = [stream for stream, records in runs if records is None]
+    if len(failed) == len(runs):
+      panel = self.plain_panel()
+      panel.append(failed[0].stderr)
+      panel.flush()
+      panel.show()
+      Logger.status("oracle call failed (" + str(failed[0].returncode) +")")
+      return
+
+    # Shards overlap wherever their packages share code, so deduplicate.
+    merged = set()
+    for _, records in runs:
+      merged.update(records or [])
+    results = OracleResults(mode, sorted(merged))
+    OracleResults.windows[self.view.window().id()] = results
+    results.render(self.view.window())
+
+    elapsed = round(time.time() - start, 1)
+    Logger.log("oracle {0} over {1} shard(s) finished in {2} seconds".format(mode, len(shards), elapsed))
+    if len(failed) > 0:
+      Logger.status("oracle "+mode+" finished with {0} of {1} shards failing ({2} results)".format(len(failed), len(shards), len(merged)))
+    else:
+      Logger.status("oracle "+mode+" finished ({0} results)".format(len(merged)))
+
+  # Splits package_scope into at most oracle_shards groups (capped at the
+  # number of cores) for modes whose results are the union of the results
+  # over each part of the scope. The package of the queried file is added
+  # to every group so each shard can resolve the query position.
+  def scope_shards(self, mode, package_scope):
+    count = min(GoToolsSettings.get().oracle_shards, multiprocessing.cpu_count(), len(package_scope))
+    if mode not in GotoolsOracleCommand.SHARDED_MODES or count < 2:
+      return [package_scope]
+
+    shards = [package_scope[i::count] for i in range(count)]
+    query_pkg = GotoolsBuildCommand.current_file_pkg(self.view)
+    if len(query_pkg) > 0:
+      shards = [shard if query_pkg in shard else shard + [query_pkg] for shard in shards]
+    return shards
+
+  # Returns the stream and parsed records of one oracle run, or None for the
+  # records if it failed.
+  def run_shard(self, mode, pos, package_scope):
+    stream = ToolRunner.stream("oracle", self.oracle_args(mode, pos, "json", package_scope), timeout=60)
+    output = stream.read()
+    if stream.returncode != 0:
+      if len(package_scope) > 0:
+        Logger.log("oracle shard {0} failed: {1}".format(package_scope, stream.stderr))
+      return (stream, None)
+    return (stream, OracleResults.parse(output))
+
+  def oracle_args(self, mode, pos, fmt, package_scope=[]):
+    return OraclePrefetcher.oracle_args(self.view.file_name(), mode, pos, fmt, package_scope)
+
+# The results of a structured oracle query, held as compact (file, line, col,
+# text) records sorted by position and grouped by file. The results panel
+# shows a page of file groups at a time; a group's records are only rendered
+# once it's expanded, and a filter narrows both groups and records.
+class OracleResults():
+  POS_RE = re.compile(r'^(.*):(\d+):(\d+)')
+  GROUPS_PER_PAGE = 100
+  RECORDS_PER_GROUP = 1000
+  PANEL_REGEX = "^\\s+(.*\\.go):(\\d+):(\\d+): (.*)$"
+  # Labels for lists of bare positions in oracle's JSON output.
+  POSITION_LABELS = {
+    "refs": "reference",
+    "allocs": "allocation",
+    "sends": "send",
+    "receives": "receive",
+    "closes": "close",
+  }
+
+  # window id -> OracleResults shown in that window's panel
+  windows = {}
+
+  def __init__(self, mode, records):
+    self.mode = mode
+    self.records = records
+    self.filter = ""
+    self.page = 0
+    self.expanded = set()
+    # panel row -> file of the group header on that row
+    self.header_rows = {}
+    self.source_lines = collections.OrderedDict()
+    self.apply_filter("")
+
+  # Extracts records from oracle's JSON output: every object with a "pos"
+  # and a description, and every list of bare positions.
+  @staticmethod
+  def parse(output):
+    records = []
+    def add(pos, text):
+      match = OracleResults.POS_RE.match(pos)
+      if match:
+        records.append((match.group(1), int(match.group(2)), int(match.group(3)), text))
+    def walk(obj, key=None):
+      if isinstance(obj, dict):
+        if isinstance(obj.get("pos"), str):
+          text = obj.get("desc")
+          if obj.get("caller"):
+            # Callers' desc is only the kind of call ("static function call").
+            text = (text + " from " if text else "") + obj["caller"]
+          if not text and obj.get("name"):
+            text = (obj.get("kind", "") + " " + obj["name"]).strip()
+          if text:
+            add(obj["pos"], text)
+        for k, v in obj.items():
+          walk(v, k)
+      elif isinstance(obj, list):
+        for v in obj:
+          if isinstance(v, str):
+            add(v, OracleResults.POSITION_LABELS.get(key, key))
+          else:
+            walk(v, key)
+    walk(json.loads(output))
+    records = sorted(set(records))
+    return records
+
+  def apply_filter(self, text):
+    self.filter = text.lower()
+    self.page = 0
+    self.groups = collections.OrderedDict()
+    for i, (file, line, col, desc) in enumerate(self.records):
+      if self.filter and self.filter not in file.lower() and self.filter not in desc.lower():
+        continue
+      self.groups.setdefault(file, []).append(i)
+
+  @property
+  def pages(self):
+    return max(1, (len(self.groups) + OracleResults.GROUPS_PER_PAGE - 1) // OracleResults.GROUPS_PER_PAGE)
+
+  def render(self, window, row=0):
+    count = sum(len(ids) for ids in self.groups.values())
+    lines = ["{0}: {1} results in {2} files, page {3}/{4}{5}".format(self.mode, count, len(self.groups),
+      self.page + 1, self.pages, ", filter: '" + self.filter + "'" if self.filter else "")]
+    lines.append("[enter] expand/collapse  [/] filter  []] next page  [[] previous page")
+    lines.append("")
+    self.header_rows = {}
+
+    start = self.page * OracleResults.GROUPS_PER_PAGE
+    files = list(self.groups.keys())[start:start + OracleResults.GROUPS_PER_PAGE]
+    package = None
+    for file in files:
+      ids = self.groups[file]
+      if os.path.dirname(file) != package:
+        package = os.path.dirname(file)
+        lines.append(package)
+      marker = "-" if file in self.expanded else "+"
+      self.header_rows[len(lines)] = file
+      lines.append("{0} {1} ({2})".format(marker, os.path.basename(file), len(ids)))
+      if file in self.expanded:
+        for i in ids[:OracleResults.RECORDS_PER_GROUP]:
+          _, line, col, desc = self.records[i]
+          source = self.source_line(file, line)
+          lines.append("    {0}:{1}:{2}: {3}{4}".format(file, line, col, desc, ": " + source if source else ""))
+        if len(ids) > OracleResults.RECORDS_PER_GROUP:
+          lines.append("    ... {0} more; use a filter to narrow".format(len(ids) - OracleResults.RECORDS_PER_GROUP))
+
+    panel = OutputPanel(window, 'gotools_oracle', OracleResults.PANEL_REGEX)
+    panel.view.settings().set("gotools_oracle_results", True)
+    panel.append("\n".join(lines) + "\n")
+    panel.flush()
+    panel.show()
+    pt = panel.view.text_point(row, 0)
+    panel.view.sel().clear()
+    panel.view.sel().add(sublime.Region(pt))
+
+  # Returns the trimmed source text of a line, reading each file at most once
+  # while it stays among the most recently used.
+  def source_line(self, file, line):
+    if file not in self.source_lines:
+      try:
+        with open(file, encoding="utf-8", errors="replace") as f:
+          self.source_lines[file] = f.read().splitlines()
+      except OSError:
+        self.source_lines[file] = []
+      while len(self.source_lines) > 16:
+        self.source_lines.popitem(last=False)
+    lines = self.source_lines[file]
+    return lines[line-1].strip() if 0 < line <= len(lines) else ""
+
+class GotoolsOracleResultsCommand(sublime_plugin.WindowCommand):
+  def run(self, action):
+    results = OracleResults.windows.get(self.window.id())
+    if not results:
+      return
+    panel = self.window.find_output_panel('gotools_oracle')
+    row = panel.rowcol(panel.sel()[0].begin())[0] if panel and len(panel.sel()) > 0 else 0
+
+    if action == "toggle":
+      file = results.header_rows.get(row)
+      if not file:
+        return
+      if file in results.expanded:
+        results.expanded.discard(file)
+      else:
+        results.expanded.add(file)
+      results.render(self.window, row)
+    elif action == "next_page":
+      results.page = min(results.page + 1, results.pages - 1)
+      results.render(self.window)
+    elif action == "previous_page":
+      results.page = max(results.page - 1, 0)
+      results.render(self.window)
+    elif action == "filter":
+      def on_done(text):
+        results.apply_filter(text)
+        results.render(self.window)
+      self.window.show_input_panel("Filter oracle results:", results.filter, on_done, None, None)
+    else:
+      Logger.log("invalid oracle results action: " + action)
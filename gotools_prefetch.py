@@ -0,0 +1,182 @@
+import sublime
+import sublime_plugin
+import collections
+import re
+import threading
+import time
+
+from .gotools_util import BuildConstraints
+from .gotools_util import Buffers
+from .gotools_util import GoBuffers
+from .gotools_util import Logger
+from .gotools_util import ToolRunner
+from .gotools_settings import GoToolsSettings
+
+# Speculatively runs oracle queries for the identifier under an idle cursor and
+# keeps the output so that goto-def and the oracle command can be answered
+# without waiting on the tool.
+#
+# Results are keyed by file, buffer change count and identifier region, so
+# any edit to the buffer makes earlier results unreachable. Saving any Go file
+# may move the declarations they point at, so saves discard every result, and
+# results older than MAX_AGE seconds are ignored to cover changes made outside
+# the editor.
+class OraclePrefetcher():
+  MAX_ENTRIES = 64
+  MAX_AGE = 60
+  # Seconds a lookup waits on a matching in-flight prefetch before giving up
+  # and letting the caller query oracle itself. Lookups run on Sublime's
+  # shared async thread, so this has to stay short.
+  LOOKUP_WAIT = 1
+  IDENTIFIER_RE = re.compile(r'^[A-Za-z_]\w*$')
+
+  lock = threading.Lock()
+  # key -> (time, output)
+  results = collections.OrderedDict()
+  # Bumped whenever a Go file is saved; part of every key.
+  epoch = 0
+  # key -> (event, stream); the stream is None until the tool has started.
+  inflight = {}
+  # view id -> idle generation, bumped on every edit or cursor move.
+  generations = {}
+
+  @staticmethod
+  def key(view, mode, pt):
+    word = view.word(pt)
+    return (OraclePrefetcher.epoch, view.file_name(), view.change_count(), word.begin(), word.end(), mode)
+
+  # Returns the prefetched output of mode for the identifier at pt (the cursor
+  # by default), or None. If a matching prefetch is still running, waits up
+  # to LOOKUP_WAIT seconds for it to finish.
+  @staticmethod
+  def lookup(view, mode, pt=None):
+    if pt is None:
+      pt = view.sel()[0].begin()
+    key = OraclePrefetcher.key(view, mode, pt)
+    with OraclePrefetcher.lock:
+      pending = OraclePrefetcher.inflight.get(key)
+    if pending:
+      Logger.log("waiting on in-flight oracle " + mode + " prefetch")
+      if not pending[0].wait(OraclePrefetcher.LOOKUP_WAIT):
+        Logger.log("oracle " + mode + " prefetch still running; querying directly")
+        return None
+    output = None
+    with OraclePrefetcher.lock:
+      result = OraclePrefetcher.results.get(key)
+      if result is not None and time.time() - result[0] < OraclePrefetcher.MAX_AGE:
+        output = result[1]
+        OraclePrefetcher.results.move_to_end(key)
+    Logger.log("oracle " + mode + " prefetch " + ("hit" if output is not None else "miss"))
+    return output
+
+  # Invalidates the pending idle timer for view and cancels its in-flight
+  # prefetches.
+  @staticmethod
+  def interrupt(view):
+    with OraclePrefetcher.lock:
+      generation = OraclePrefetcher.generations.get(view.id(), 0) + 1
+      OraclePrefetcher.generations[view.id()] = generation
+      streams = [s for k, (e, s) in OraclePrefetcher.inflight.items() if k[1] == view.file_name() and s]
+    for s in streams:
+      s.cancel()
+    return generation
+
+  # Discards every result, and makes the output of prefetches still running
+  # unreachable.
+  @staticmethod
+  def invalidate():
+    with OraclePrefetcher.lock:
+      OraclePrefetcher.epoch += 1
+      OraclePrefetcher.results.clear()
+
+  # Called once the cursor has rested for oracle_prefetch_delay. Starts
+  # describe (and definition, when oracle is the goto-def backend) for the
+  # identifier under the cursor, within the oracle_prefetch_limit budget.
+  @staticmethod
+  def on_idle(view, generation):
+    if OraclePrefetcher.generations.get(view.id()) != generation:
+      return
+    if not view.file_name() or view.is_dirty():
+      # Oracle reads files from disk, so offsets into a dirty buffer are wrong.
+      return
+    sel = view.sel()
+    if len(sel) != 1 or not sel[0].empty():
+      return
+    pt = sel[0].begin()
+    if not OraclePrefetcher.IDENTIFIER_RE.match(view.substr(view.word(pt))):
+      return
+
+    modes = ["describe"]
+    if GoToolsSettings.get().goto_def_backend == "oracle":
+      modes.append("definition")
+
+    row, col = view.rowcol(pt)
+    pos = view.file_name() + ":#" + str(Buffers.offset_at_row_col(view, row, col))
+    for mode in modes:
+      key = OraclePrefetcher.key(view, mode, pt)
+      with OraclePrefetcher.lock:
+        result = OraclePrefetcher.results.get(key)
+        if (result and time.time() - result[0] < OraclePrefetcher.MAX_AGE) or key in OraclePrefetcher.inflight:
+          continue
+        if len(OraclePrefetcher.inflight) >= GoToolsSettings.get().oracle_prefetch_limit:
+          Logger.log("oracle prefetch budget exhausted; skipping " + mode)
+          return
+        OraclePrefetcher.inflight[key] = (threading.Event(), None)
+      threading.Thread(target=OraclePrefetcher.prefetch, args=(key, mode, pos)).start()
+
+  # Returns the oracle arguments for a query on filename. Direct queries and
+  # prefetches both build their arguments here, so a prefetched result is
+  # always computed under the build tags of the query it answers.
+  @staticmethod
+  def oracle_args(filename, mode, pos, fmt, package_scope=[]):
+    args = ["-pos="+pos, "-format="+fmt]
+    tags = BuildConstraints.tags_for_file(filename)
+    if len(tags) > 0:
+      args.append("-tags=" + " ".join(tags))
+    args.append(mode)
+    return args + package_scope
+
+  @staticmethod
+  def prefetch(key, mode, pos):
+    fmt = "json" if mode == "definition" else "plain"
+    args = OraclePrefetcher.oracle_args(key[1], mode, pos, fmt, GoToolsSettings.get().package_scope)
+    event = OraclePrefetcher.inflight[key][0]
+    try:
+      stream = ToolRunner.stream("oracle", args, timeout=60, low_priority=True)
+      with OraclePrefetcher.lock:
+        OraclePrefetcher.inflight[key] = (event, stream)
+      output = stream.read()
+      if stream.returncode == 0:
+        with OraclePrefetcher.lock:
+          if key[0] == OraclePrefetcher.epoch:
+            OraclePrefetcher.results[key] = (time.time(), output)
+          while len(OraclePrefetcher.results) > OraclePrefetcher.MAX_ENTRIES:
+            OraclePrefetcher.results.popitem(last=False)
+        Logger.log("prefetched oracle " + mode + " for " + pos)
+    except Exception as e:
+      Logger.log("oracle " + mode + " prefetch failed: " + str(e))
+    finally:
+      with OraclePrefetcher.lock:
+        del OraclePrefetcher.inflight[key]
+      event.set()
+
+class GotoolsOraclePrefetch(sublime_plugin.EventListener):
+  def on_selection_modified_async(self, view):
+    self.reschedule(view)
+
+  def on_modified_async(self, view):
+    self.reschedule(view)
+
+  def on_post_save_async(self, view):
+    if not GoBuffers.is_go_source(view): return
+    OraclePrefetcher.invalidate()
+
+  def on_close(self, view):
+    OraclePrefetcher.interrupt(view)
+    OraclePrefetcher.generations.pop(view.id(), None)
+
+  def reschedule(self, view):
+    if not GoBuffers.is_go_source(view): return
+    if not GoToolsSettings.get().oracle_prefetch: return
+    generation = OraclePrefetcher.interrupt(view)
+    sublime.set_timeout_async(lambda: OraclePrefetcher.on_idle(view, generation), GoToolsSettings.get().oracle_prefetch_delay)
@@ -5,6 +5,7 @@ import os
 from .gotools_util import Buffers
 from .gotools_util import GoBuffers
 from .gotools_util import Logger
+from .gotools_util import OutputPanel
 from .gotools_util import ToolRunner
 from .gotools_settings import GoToolsSettings
 
@@ -25,20 +26,20 @@ class GotoolsRenameCommand(sublime_plugin.TextCommand):
       "-to", name,
       "-v"
     ]
-    output, err, exit = ToolRunner.run("gorename", args, timeout=15)
 
-    if exit != 0:
-      Logger.status("rename failed ({0}): {1}".format(exit, err))
-      return
-    Logger.status("renamed symbol to {name}".format(name=name))
-
-    panel = self.view.window().create_output_panel('gotools_rename')
-    panel.set_scratch(True)
+    panel = OutputPanel(self.view.window(), 'gotools_rename', "^\t(.*\.go)$")
     # TODO: gorename isn't emitting line numbers, so to get clickable
     # referenced we'd need to process each line to append ':N' to make the
     # sublime regex work properly (line number is a required capture group).
-    panel.settings().set("result_file_regex", "^\t(.*\.go)$")
-    panel.run_command("select_all")
-    panel.run_command("right_delete")
-    panel.run_command('append', {'characters': err})
-    self.view.window().run_command("show_panel", {"panel": "output.gotools_rename"})
+    panel.show()
+    # gorename reports its progress on stderr.
+    stream = ToolRunner.stream("gorename", args, timeout=15, merge_stderr=True)
+    panel.follow(stream)
+
+    if stream.cancelled:
+      Logger.status("rename cancelled")
+      return
+    if stream.returncode != 0:
+      Logger.status("rename failed ({0})".format(stream.returncode))
+      return
+    Logger.status("renamed symbol to {name}".format(name=name))
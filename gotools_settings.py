@@ -39,7 +39,12 @@ class GoToolsSettings():
   # view every time. This doesn't seem ideal.
   @property
   def project_settings(self):
-    return sublime.active_window().active_view().settings().get('GoTools', {})
+    window = sublime.active_window()
+    view = window.active_view() if window else None
+    # There may be no view yet, e.g. while warming up during plugin load.
+    if view is None:
+      return {}
+    return view.settings().get('GoTools', {})
 
   # Returns setting with key, preferring project settings over plugin settings
   # and using default if neither is found. Key values with 0 length when
@@ -78,6 +83,19 @@ class GoToolsSettings():
       gopath = self.project_settings['gopath'].replace('${gopath}', sub)
     return gopath
 
+  # The GOPATH split into its individual, non-empty entries.
+  @property
+  def gopath_entries(self):
+    return [p for p in self.gopath.split(os.pathsep) if len(p) > 0]
+
+  # Every source root which holds Go packages: each GOPATH entry's src
+  # directory followed by GOROOT/src.
+  @property
+  def source_roots(self):
+    roots = [os.path.join(p, "src") for p in self.gopath_entries]
+    roots.append(os.path.join(self.goroot, "src"))
+    return roots
+
   @property
   def goroot(self):
     return self.get_setting('goroot', self.env["GOROOT"])
@@ -108,7 +126,7 @@ class GoToolsSettings():
     libpath = []
     arch = "{0}_{1}".format(self.goos, self.goarch)
     libpath.append(os.path.join(self.goroot, "pkg", self.gohostosarch))
-    for p in self.gopath.split(":"):
+    for p in self.gopath_entries:
       libpath.append(os.path.join(p, "pkg", arch))
     return ":".join(libpath)
 
@@ -128,6 +146,26 @@ class GoToolsSettings():
   def format_backend(self):
     return self.get_setting("format_backend")
 
+  @property
+  def check_on_save(self):
+    return self.get_setting("check_on_save", False)
+
+  @property
+  def check_on_save_delay(self):
+    return self.get_setting("check_on_save_delay", 500)
+
+  @property
+  def check_vet(self):
+    return self.get_setting("check_vet", False)
+
+  @property
+  def large_buffer_threshold(self):
+    return self.get_setting("large_buffer_threshold", 1048576)
+
+  @property
+  def format_workers(self):
+    return self.get_setting("format_workers", 4)
+
   @property
   def autocomplete(self):
     return self.get_setting("autocomplete")
@@ -140,6 +178,16 @@ class GoToolsSettings():
   def project_package(self):
     return self.get_setting("project_package")
 
+  # The directory of project_package in the first GOPATH entry containing it,
+  # or None.
+  @property
+  def project_package_dir(self):
+    for gopath in self.gopath_entries:
+      d = os.path.join(gopath, "src", self.project_package)
+      if os.path.exists(d):
+        return d
+    return None
+
   @property
   def build_packages(self):
     return self.get_setting("build_packages", [])
@@ -164,6 +212,42 @@ class GoToolsSettings():
   def test_timeout(self):
     return self.get_setting("test_timeout", None)
 
+  @property
+  def test_binary_cache(self):
+    return self.get_setting("test_binary_cache", False)
+
+  @property
+  def test_watch_delay(self):
+    return self.get_setting("test_watch_delay", 1000)
+
+  # All packages the user might have configured, used as the oracle scope.
+  @property
+  def package_scope(self):
+    package_scope = []
+    for p in self.build_packages + self.test_packages + self.tagged_test_packages:
+      package_scope.append(os.path.join(self.project_package, p))
+    return package_scope
+
+  @property
+  def oracle_shards(self):
+    return self.get_setting("oracle_shards", 0)
+
+  @property
+  def oracle_prefetch(self):
+    return self.get_setting("oracle_prefetch", False)
+
+  @property
+  def oracle_prefetch_delay(self):
+    return self.get_setting("oracle_prefetch_delay", 750)
+
+  @property
+  def oracle_prefetch_limit(self):
+    return self.get_setting("oracle_prefetch_limit", 2)
+
+  @property
+  def symbol_index_workers(self):
+    return self.get_setting("symbol_index_workers", 4)
+
   # Load PATH, GOPATH, GOROOT, and anything `go env` can provide. Use the
   # precedence order: Login shell > OS env > go env. The environment is
   # returned as a dict.
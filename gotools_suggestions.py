@@ -6,6 +6,7 @@ import os
 from .gotools_util import Buffers
 from .gotools_util import GoBuffers
 from .gotools_util import Logger
+from .gotools_util import MemoryTrace
 from .gotools_util import ToolRunner
 from .gotools_settings import GoToolsSettings
 
@@ -20,12 +21,15 @@ class GotoolsSuggestions(sublime_plugin.EventListener):
   def on_query_completions(self, view, prefix, locations):
     if not GoBuffers.is_go_source(view): return
     if not GoToolsSettings.get().autocomplete: return
+    with MemoryTrace("autocomplete"):
+      return self.complete(view)
 
+  def complete(self, view):
     # set the lib-path for gocode's lookups
-    _, _, rc = ToolRunner.run("gocode", ["set", "lib-path", GoToolsSettings.get().golibpath])
+    GotoolsSuggestions.set_lib_path()
 
     suggestionsJsonStr, stderr, rc = ToolRunner.run("gocode", ["-f=json", "autocomplete", 
-      str(Buffers.offset_at_cursor(view)[0])], stdin=Buffers.buffer_text(view))
+      str(Buffers.offset_at_cursor(view)[0])], stdin=Buffers.buffer_stdin(view))
 
     # TODO: restore gocode's lib-path
 
@@ -42,6 +46,13 @@ class GotoolsSuggestions(sublime_plugin.EventListener):
     else:
       return []
 
+  # Points gocode at the lib-path for the current GOPATH. This also starts the
+  # gocode daemon if it isn't running. The lib-path is sent before every
+  # request, since a restarted daemon comes back with the default one.
+  @staticmethod
+  def set_lib_path():
+    ToolRunner.run("gocode", ["set", "lib-path", GoToolsSettings.get().golibpath])
+
   @staticmethod
   def build_suggestion(json):
     label = '{0: <30.30} {1: <40.40} {2}'.format(
@@ -0,0 +1,535 @@
+import sublime
+import sublime_plugin
+import array
+import concurrent.futures
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+from .gotools_util import Logger
+from .gotools_settings import GoToolsSettings
+
+# Extracts exported top-level declarations from Go source files. This is a
+# line-oriented scan which relies on gofmt'd layout (top-level declarations
+# start at column 0, grouped declarations are indented by one tab) rather than
+# a real parser, which keeps indexing all of GOPATH cheap enough to run in the
+# background.
+class GoSymbolParser():
+  FUNC_RE = re.compile(r'^func\s+(?:\(\s*(?:\w+\s+)?\*?\s*(\w+)[^)]*\)\s*)?(\w+)')
+  DECL_RE = re.compile(r'^(var|const|type)\s+(\w+(?:\s*,\s*\w+)*)')
+  GROUP_START_RE = re.compile(r'^(var|const|type)\s*\(\s*$')
+  GROUP_MEMBER_RE = re.compile(r'^\t(\w+(?:\s*,\s*\w+)*)')
+  # Line comments, block comment and raw string openers, and whole
+  # interpreted string and rune literals (which may hold any of the others).
+  TOKEN_RE = re.compile(r'//|/\*|`|"(?:[^"\\]|\\.)*"?|\'(?:[^\'\\]|\\.)*\'?')
+
+  # Returns a list of (name, kind, line) tuples for the exported declarations
+  # in the file at path. Methods are named "Receiver.Method".
+  @staticmethod
+  def parse_file(path):
+    symbols = []
+    try:
+      with open(path, encoding="utf-8", errors="replace") as f:
+        lines = f.read().splitlines()
+    except OSError as e:
+      Logger.log("couldn't read {0}: {1}".format(path, str(e)))
+      return symbols
+
+    group = None
+    state = None
+    for lineno, line in enumerate(lines, start=1):
+      # Lines which start inside a block comment or raw string can't hold a
+      # declaration.
+      if state is None:
+        if group:
+          if line.startswith(")"):
+            group = None
+          else:
+            match = GoSymbolParser.GROUP_MEMBER_RE.match(line)
+            if match:
+              GoSymbolParser.add_names(symbols, match.group(1), group, lineno)
+        else:
+          match = GoSymbolParser.FUNC_RE.match(line)
+          if match:
+            recv, name = match.group(1), match.group(2)
+            if recv:
+              if GoSymbolParser.is_exported(recv) and GoSymbolParser.is_exported(name):
+                symbols.append((recv + "." + name, "method", lineno))
+            elif GoSymbolParser.is_exported(name):
+              symbols.append((name, "func", lineno))
+          else:
+            match = GoSymbolParser.GROUP_START_RE.match(line)
+            if match:
+              group = match.group(1)
+            else:
+              match = GoSymbolParser.DECL_RE.match(line)
+              if match:
+                GoSymbolParser.add_names(symbols, match.group(2), match.group(1), lineno)
+
+      state = GoSymbolParser.scan(line, state)
+
+    return symbols
+
+  # Returns the lexical state at the end of line given the state at its start:
+  # None for code, "comment" inside a block comment, or "raw" inside a raw
+  # string. Line comments and interpreted string and rune literals are
+  # skipped, so backticks inside them don't start a raw string.
+  @staticmethod
+  def scan(line, state):
+    if state is None and "`" not in line and "/*" not in line:
+      return None
+    i = 0
+    while True:
+      if state == "comment":
+        end = line.find("*/", i)
+        if end < 0:
+          return state
+        state, i = None, end + 2
+      elif state == "raw":
+        end = line.find("`", i)
+        if end < 0:
+          return state
+        state, i = None, end + 1
+      else:
+        match = GoSymbolParser.TOKEN_RE.search(line, i)
+        if not match:
+          return None
+        token = match.group(0)
+        if token == "//":
+          return None
+        elif token == "/*":
+          state = "comment"
+        elif token == "`":
+          state = "raw"
+        i = match.end()
+
+  @staticmethod
+  def add_names(symbols, names, kind, lineno):
+    for name in names.split(","):
+      name = name.strip()
+      if GoSymbolParser.is_exported(name):
+        symbols.append((name, kind, lineno))
+
+  @staticmethod
+  def is_exported(name):
+    return len(name) > 0 and name[0].isupper()
+
+# A read-only view of an on-disk symbol database. The file is memory-mapped
+# and searched in place, so only the records matching a query are ever
+# materialized as Python objects.
+#
+# Layout (all integers little-endian):
+#
+#   header    magic, record/file/trigram counts and section offsets
+#   records   RECORD entries sorted by lowercased name
+#   files     FILE entries (offset and length of each path in strings)
+#   strings   utf-8 names and paths
+#   trigrams  TRIGRAM entries sorted by trigram
+#   postings  uint32 record indexes for each trigram, ascending
+class SymbolDatabase():
+  MAGIC = b"GTSYM001"
+  HEADER = struct.Struct("<8s8I")
+  RECORD = struct.Struct("<IHBxII")
+  FILE = struct.Struct("<II")
+  TRIGRAM = struct.Struct("<III")
+  POSTING = struct.Struct("<I")
+  KINDS = ("func", "method", "type", "var", "const")
+
+  def __init__(self, path):
+    self.file = open(path, "rb")
+    try:
+      self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception:
+      self.file.close()
+      raise
+    (magic, self.nrecords, self.nfiles, self.ntrigrams, self.records_off,
+      self.files_off, self.strings_off, self.trigrams_off, self.postings_off) = SymbolDatabase.HEADER.unpack_from(self.data, 0)
+    if magic != SymbolDatabase.MAGIC:
+      self.close()
+      raise Exception("unrecognized symbol database format: " + path)
+
+  def close(self):
+    self.data.close()
+    self.file.close()
+
+  def __len__(self):
+    return self.nrecords
+
+  # Returns up to limit (name, kind, file, line) tuples whose name contains
+  # the last whitespace-separated term of query (case-insensitive). Any
+  # preceding terms must appear in the symbol's file path, which allows
+  # narrowing by package, e.g. "net/http handler". Exact matches sort first,
+  # then prefix matches, then substring matches.
+  def search(self, query, limit=1000):
+    terms = query.lower().split()
+    if len(terms) == 0:
+      return []
+    needle = terms[-1].encode("utf-8")
+    path_terms = terms[:-1]
+
+    if len(needle) >= 3:
+      candidates = self.trigram_candidates(needle)
+    else:
+      candidates = self.prefix_candidates(needle)
+
+    ranked = []
+    for i in candidates:
+      name_off, name_len, kind, file_idx, line = SymbolDatabase.RECORD.unpack_from(self.data, self.records_off + i * SymbolDatabase.RECORD.size)
+      name = self.string(name_off, name_len)
+      key = name.lower().encode("utf-8")
+      if key == needle:
+        rank = 0
+      elif key.startswith(needle):
+        rank = 1
+      elif needle in key:
+        rank = 2
+      else:
+        continue
+      path = self.file_path(file_idx)
+      if path_terms and not all(t in path.lower() for t in path_terms):
+        continue
+      ranked.append((rank, len(name), name, SymbolDatabase.KINDS[kind], path, line))
+
+    ranked.sort()
+    return [r[2:] for r in ranked[:limit]]
+
+  # Yields every (name, kind, file, line) record in the database.
+  def records(self):
+    for i in range(self.nrecords):
+      name_off, name_len, kind, file_idx, line = SymbolDatabase.RECORD.unpack_from(self.data, self.records_off + i * SymbolDatabase.RECORD.size)
+      yield (self.string(name_off, name_len), SymbolDatabase.KINDS[kind], self.file_path(file_idx), line)
+
+  def string(self, off, length):
+    start = self.strings_off + off
+    return self.data[start:start + length].decode("utf-8")
+
+  def file_path(self, idx):
+    off, length = SymbolDatabase.FILE.unpack_from(self.data, self.files_off + idx * SymbolDatabase.FILE.size)
+    return self.string(off, length)
+
+  def record_key(self, i):
+    name_off, name_len, _, _, _ = SymbolDatabase.RECORD.unpack_from(self.data, self.records_off + i * SymbolDatabase.RECORD.size)
+    return self.string(name_off, name_len).lower().encode("utf-8")
+
+  # Record indexes whose lowercased name starts with prefix, found by binary
+  # search over the sorted record table.
+  def prefix_candidates(self, prefix):
+    lo, hi = 0, self.nrecords
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self.record_key(mid) < prefix:
+        lo = mid + 1
+      else:
+        hi = mid
+    i = lo
+    while i < self.nrecords and self.record_key(i).startswith(prefix):
+      yield i
+      i += 1
+
+  # Record indexes containing every trigram of needle. The shortest posting
+  # list is loaded and then filtered by binary search against the others,
+  # which stay in the mapping.
+  def trigram_candidates(self, needle):
+    postings = []
+    for code in set(SymbolDatabase.trigrams(needle)):
+      entry = self.find_trigram(code)
+      if entry is None:
+        return []
+      postings.append(entry)
+    postings.sort(key=lambda p: p[1])
+
+    off, count = postings[0]
+    start = self.postings_off + off * SymbolDatabase.POSTING.size
+    candidates = struct.unpack_from("<{0}I".format(count), self.data, start)
+    for off, count in postings[1:]:
+      candidates = [i for i in candidates if self.posting_contains(off, count, i)]
+      if len(candidates) == 0:
+        break
+    return candidates
+
+  def find_trigram(self, code):
+    lo, hi = 0, self.ntrigrams
+    while lo < hi:
+      mid = (lo + hi) // 2
+      mid_code, off, count = SymbolDatabase.TRIGRAM.unpack_from(self.data, self.trigrams_off + mid * SymbolDatabase.TRIGRAM.size)
+      if mid_code < code:
+        lo = mid + 1
+      elif mid_code > code:
+        hi = mid
+      else:
+        return (off, count)
+    return None
+
+  def posting_contains(self, off, count, value):
+    lo, hi = 0, count
+    base = self.postings_off + off * SymbolDatabase.POSTING.size
+    while lo < hi:
+      mid = (lo + hi) // 2
+      v, = SymbolDatabase.POSTING.unpack_from(self.data, base + mid * SymbolDatabase.POSTING.size)
+      if v < value:
+        lo = mid + 1
+      elif v > value:
+        hi = mid
+      else:
+        return True
+    return False
+
+  @staticmethod
+  def trigrams(key):
+    for i in range(len(key) - 2):
+      yield (key[i] << 16) | (key[i+1] << 8) | key[i+2]
+
+  # Writes symbols, an iterable of (name, kind, file, line) tuples, to a new
+  # database at path. The file is written next to path and moved into place
+  # so readers never observe a partial database.
+  @staticmethod
+  def write(path, symbols):
+    entries = sorted((name.lower().encode("utf-8"), name, kind, file, line) for name, kind, file, line in symbols)
+
+    strings = bytearray()
+    files = {}
+    file_table = bytearray()
+    records = bytearray()
+    trigrams = {}
+    for i, (key, name, kind, file, line) in enumerate(entries):
+      if file not in files:
+        encoded = file.encode("utf-8")
+        files[file] = len(files)
+        file_table += SymbolDatabase.FILE.pack(len(strings), len(encoded))
+        strings += encoded
+      encoded = name.encode("utf-8")
+      records += SymbolDatabase.RECORD.pack(len(strings), len(encoded), SymbolDatabase.KINDS.index(kind), files[file], line)
+      strings += encoded
+      for code in set(SymbolDatabase.trigrams(key)):
+        if code not in trigrams:
+          trigrams[code] = array.array("I")
+        trigrams[code].append(i)
+
+    trigram_table = bytearray()
+    postings = bytearray()
+    nposting = 0
+    for code in sorted(trigrams):
+      ids = trigrams[code]
+      trigram_table += SymbolDatabase.TRIGRAM.pack(code, nposting, len(ids))
+      postings += struct.pack("<{0}I".format(len(ids)), *ids)
+      nposting += len(ids)
+
+    records_off = SymbolDatabase.HEADER.size
+    files_off = records_off + len(records)
+    strings_off = files_off + len(file_table)
+    trigrams_off = strings_off + len(strings)
+    postings_off = trigrams_off + len(trigram_table)
+    header = SymbolDatabase.HEADER.pack(SymbolDatabase.MAGIC, len(entries), len(files), len(trigrams),
+      records_off, files_off, strings_off, trigrams_off, postings_off)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+      for section in [header, records, file_table, strings, trigram_table, postings]:
+        f.write(section)
+    return tmp
+
+# Maintains the GOPATH-wide symbol database for the current GOPATH and GOROOT.
+# A JSON manifest alongside the database records a modification stamp for
+# every package directory, so updates only re-parse packages which changed
+# since the last run; the symbols of unchanged packages are copied over from
+# the previous database.
+class SymbolIndex():
+  # Seconds after an update during which opening the symbol palette doesn't
+  # walk the source roots again.
+  REFRESH_INTERVAL = 300
+
+  lock = threading.Lock()
+  instance = None
+
+  def __init__(self, roots):
+    self.roots = roots
+    self.db = None
+    self.db_lock = threading.Lock()
+    self.updating = False
+    self.last_update = 0
+    key = hashlib.sha1(os.pathsep.join(roots).encode("utf-8")).hexdigest()[:12]
+    cache_dir = os.path.join(sublime.cache_path(), "GoTools")
+    os.makedirs(cache_dir, exist_ok=True)
+    self.db_path = os.path.join(cache_dir, "symbols-" + key + ".db")
+    self.manifest_path = os.path.join(cache_dir, "symbols-" + key + ".stamps.json")
+    if os.path.isfile(self.db_path):
+      try:
+        self.db = SymbolDatabase(self.db_path)
+      except Exception as e:
+        Logger.log("discarding unreadable symbol database: " + str(e))
+
+  # Returns the index for the currently configured source roots, replacing
+  # the previous one if GOPATH or GOROOT changed.
+  @staticmethod
+  def get():
+    roots = GoToolsSettings.get().source_roots
+    with SymbolIndex.lock:
+      if SymbolIndex.instance is None or SymbolIndex.instance.roots != roots:
+        SymbolIndex.instance = SymbolIndex(roots)
+      return SymbolIndex.instance
+
+  def search(self, query, limit=1000):
+    with self.db_lock:
+      if self.db is None:
+        return None
+      return self.db.search(query, limit)
+
+  # Starts bringing the database up to date on a background thread, unless
+  # an update is already running or one finished within REFRESH_INTERVAL.
+  # When full is set, every package is re-parsed regardless.
+  def update(self, full=False):
+    with SymbolIndex.lock:
+      if self.updating:
+        Logger.log("symbol index update already in progress")
+        return
+      if not full and self.db is not None and time.time() - self.last_update < SymbolIndex.REFRESH_INTERVAL:
+        return
+      self.updating = True
+    threading.Thread(target=self.run_update, args=(full,), daemon=True).start()
+
+  def run_update(self, full):
+    try:
+      self.do_update(full)
+      self.last_update = time.time()
+    except Exception as e:
+      Logger.error("symbol index update failed: " + str(e))
+    finally:
+      with SymbolIndex.lock:
+        self.updating = False
+
+  # Unchanged package directories are reused from the previous database; the
+  # rest are parsed by a pool of symbol_index_workers threads.
+  def do_update(self, full):
+    start = time.time()
+    manifest = {}
+    if not full and self.db is not None and os.path.isfile(self.manifest_path):
+      try:
+        with open(self.manifest_path, encoding="utf-8") as f:
+          manifest = json.load(f)
+      except ValueError as e:
+        Logger.log("discarding unreadable symbol manifest: " + str(e))
+
+    stamps = {}
+    stale = []
+    for pkg_dir, stamp, files in self.find_package_dirs():
+      stamps[pkg_dir] = stamp
+      if manifest.get(pkg_dir) != stamp:
+        stale.append((pkg_dir, files))
+
+    if len(stale) == 0 and len(stamps) == len(manifest) and self.db is not None:
+      Logger.log("symbol index is up to date ({0} symbols)".format(len(self.db)))
+      return
+
+    Logger.status("indexing symbols in {0} packages...".format(len(stale)))
+    symbols = []
+    done = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=GoToolsSettings.get().symbol_index_workers) as pool:
+      futures = [pool.submit(self.parse_package, pkg_dir, files) for pkg_dir, files in stale]
+      for future in concurrent.futures.as_completed(futures):
+        symbols.extend(future.result())
+        done += 1
+        if done % 500 == 0:
+          Logger.status("indexed {0}/{1} packages".format(done, len(stale)))
+
+    # Everything else still in the old database belongs to a package which
+    # is unchanged, or which has been removed.
+    reparsed = set(pkg_dir for pkg_dir, _ in stale)
+    if self.db is not None and len(manifest) > 0:
+      for name, kind, file, line in self.db.records():
+        pkg_dir = os.path.dirname(file)
+        if pkg_dir in stamps and pkg_dir not in reparsed:
+          symbols.append((name, kind, file, line))
+
+    tmp = SymbolDatabase.write(self.db_path, symbols)
+    symbols = None
+
+    # The old mapping has to be released before the file can be replaced on
+    # Windows.
+    with self.db_lock:
+      if self.db is not None:
+        self.db.close()
+        self.db = None
+      os.replace(tmp, self.db_path)
+      self.db = SymbolDatabase(self.db_path)
+
+    with open(self.manifest_path + ".tmp", "w", encoding="utf-8") as f:
+      json.dump(stamps, f)
+    os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+    elapsed = round(time.time() - start, 1)
+    Logger.log("indexed {0} symbols ({1} packages re-parsed) in {2} seconds".format(len(self.db), len(stale), elapsed))
+    Logger.status("symbol index updated ({0} symbols)".format(len(self.db)))
+
+  # Yields (package dir, stamp, go files) for every package directory under
+  # the source roots, skipping the directories the go tool ignores. The stamp
+  # is the newest mtime of the directory and its Go files, so both added or
+  # removed files and in-place edits invalidate the package.
+  def find_package_dirs(self):
+    for root in self.roots:
+      for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not (d.startswith(".") or d.startswith("_") or d == "testdata")]
+        files = [f for f in filenames if f.endswith(".go") and not f.endswith("_test.go")]
+        if len(files) == 0:
+          continue
+        try:
+          stamp = os.stat(dirpath).st_mtime
+          for f in files:
+            stamp = max(stamp, os.stat(os.path.join(dirpath, f)).st_mtime)
+        except OSError:
+          continue
+        yield (dirpath, stamp, files)
+
+  @staticmethod
+  def parse_package(pkg_dir, files):
+    symbols = []
+    for filename in files:
+      path = os.path.join(pkg_dir, filename)
+      for name, kind, line in GoSymbolParser.parse_file(path):
+        symbols.append((name, kind, path, line))
+    return symbols
+
+class GotoolsGotoSymbolCommand(sublime_plugin.WindowCommand):
+  def run(self):
+    index = SymbolIndex.get()
+    index.update()
+    self.window.show_input_panel("Go to symbol in GOPATH:", "", lambda query: self.search(index, query), None, None)
+
+  def search(self, index, query):
+    start = time.time()
+    results = index.search(query)
+    if results is None:
+      Logger.status("symbol index is still being built; try again shortly")
+      return
+    Logger.log("symbol search for '{0}' returned {1} results in {2}ms".format(query, len(results), round((time.time() - start) * 1000, 1)))
+    if len(results) == 0:
+      Logger.status("no symbols found matching '{0}'".format(query))
+      return
+
+    items = []
+    for name, kind, file, line in results:
+      items.append([name, "{0}  {1}:{2}".format(kind, self.display_path(index, file), line)])
+
+    def on_select(i):
+      if i < 0:
+        return
+      _, _, file, line = results[i]
+      self.window.open_file(file + ":" + str(line), sublime.ENCODED_POSITION)
+
+    self.window.show_quick_panel(items, on_select)
+
+  @staticmethod
+  def display_path(index, file):
+    for root in index.roots:
+      if file.startswith(root + os.sep):
+        return os.path.relpath(file, root)
+    return file
+
+class GotoolsRebuildSymbolIndexCommand(sublime_plugin.WindowCommand):
+  def run(self):
+    index = SymbolIndex.get()
+    index.update(full=True)
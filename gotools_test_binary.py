@@ -0,0 +1,100 @@
+import sublime
+import hashlib
+import os
+import platform
+
+from .gotools_util import Logger
+from .gotools_util import ToolRunner
+from .gotools_settings import GoToolsSettings
+
+# Keeps compiled test binaries (`go test -c`) so repeated runs of the same
+# package's tests skip compiling and linking. Binaries are keyed by package
+# and tags, and named by a fingerprint of the sources of the package and all
+# of its non-GOROOT dependencies (including test-only imports), so a binary
+# is rebuilt only when one of those changes.
+class TestBinaryCache():
+  LIST_TEMPLATE = '{{.ImportPath}}\t{{.Dir}}\t{{.Goroot}}\t{{join .Deps " "}}\t{{join .TestImports " "}}\t{{join .XTestImports " "}}'
+  SOURCE_EXTENSIONS = (".go", ".c", ".h", ".s", ".S", ".cc", ".cpp", ".hh", ".syso")
+
+  # Returns (binary path, package dir) for pkg, building the binary first if
+  # no up-to-date one is cached. Raises an exception carrying the compiler
+  # output if the build fails.
+  @staticmethod
+  def get(pkg, tags=[]):
+    dirs = TestBinaryCache.source_dirs(pkg, tags)
+    if pkg not in dirs:
+      raise Exception("couldn't find package " + pkg)
+
+    key = hashlib.sha1((pkg + "\0" + ",".join(tags)).encode("utf-8")).hexdigest()[:16]
+    cache_dir = os.path.join(sublime.cache_path(), "GoTools", "testbin", key)
+    name = TestBinaryCache.fingerprint(dirs, tags)[:16] + ".test"
+    if platform.system() == "Windows":
+      name += ".exe"
+    binary = os.path.join(cache_dir, name)
+
+    if os.path.isfile(binary):
+      Logger.log("reusing test binary for {0}: {1}".format(pkg, binary))
+      return (binary, dirs[pkg])
+
+    Logger.status("compiling tests for " + pkg + "...")
+    os.makedirs(cache_dir, exist_ok=True)
+    args = ["test", "-c", "-o", binary]
+    if len(tags) > 0:
+      args += ["-tags", ",".join(tags)]
+    output, err, rc = ToolRunner.run("go", args + [pkg], timeout=300)
+    if rc != 0:
+      raise Exception(output + err)
+    if not os.path.isfile(binary):
+      # Packages without tests produce no binary.
+      raise Exception("no test files in " + pkg)
+
+    # Only the newest binary of each package is worth keeping.
+    for f in os.listdir(cache_dir):
+      if f != name:
+        os.remove(os.path.join(cache_dir, f))
+    return (binary, dirs[pkg])
+
+  # Returns {import path: dir} for pkg and every dependency of it and its
+  # tests which lives outside GOROOT.
+  @staticmethod
+  def source_dirs(pkg, tags):
+    dirs = {}
+    seen = set()
+    pending = set([pkg])
+    tag_args = ["-tags", ",".join(tags)] if len(tags) > 0 else []
+    while len(pending) > 0:
+      output, err, rc = ToolRunner.run("go", ["list", "-e", "-f", TestBinaryCache.LIST_TEMPLATE] + tag_args + sorted(pending), timeout=60)
+      seen.update(pending)
+      pending = set()
+      for line in output.splitlines():
+        fields = line.split("\t")
+        if len(fields) != 6:
+          continue
+        import_path, pkg_dir, goroot, deps, test_imports, xtest_imports = fields
+        if goroot != "true" and len(pkg_dir) > 0:
+          dirs[import_path] = pkg_dir
+        imports = deps.split()
+        if import_path == pkg:
+          imports += test_imports.split() + xtest_imports.split()
+        pending.update(i for i in imports if i not in seen and i != "C")
+    return dirs
+
+  @staticmethod
+  def fingerprint(dirs, tags):
+    h = hashlib.sha1()
+    go = ToolRunner.find_tool("go")
+    for part in [go, str(os.path.getmtime(go)), GoToolsSettings.get().gopath, ",".join(tags)]:
+      h.update(part.encode("utf-8") + b"\0")
+    for import_path in sorted(dirs):
+      pkg_dir = dirs[import_path]
+      h.update(pkg_dir.encode("utf-8") + b"\0")
+      try:
+        filenames = sorted(os.listdir(pkg_dir))
+      except OSError:
+        continue
+      for f in filenames:
+        if not f.endswith(TestBinaryCache.SOURCE_EXTENSIONS):
+          continue
+        st = os.stat(os.path.join(pkg_dir, f))
+        h.update("{0}\0{1}\0{2}\0".format(f, st.st_mtime, st.st_size).encode("utf-8"))
+    return h.hexdigest()
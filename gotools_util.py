@@ -1,16 +1,34 @@
 import sublime
+import sublime_plugin
 import os
 import re
 import platform
+import signal
 import subprocess
+import threading
 import time
 
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
 from .gotools_settings import GoToolsSettings
 
 class Buffers():
+  CHUNK_SIZE = 65536
+
   @staticmethod
   def offset_at_row_col(view, row, col):
     point = view.text_point(row, col)
+    if Buffers.is_large(view):
+      # Count the prefix a chunk at a time rather than copying all of it.
+      return sum(len(chunk) for chunk in Buffers.buffer_chunks(view, 0, point))
     select_region = sublime.Region(0, point)
     string_region = view.substr(select_region)
     buffer_region = bytearray(string_region, encoding="utf8")
@@ -22,6 +40,31 @@ class Buffers():
     file_text = sublime.Region(0, view.size())
     return view.substr(file_text).encode('utf-8')
 
+  # Whether the view is above large_buffer_threshold, in which case its
+  # content should be handled in chunks instead of as a whole.
+  @staticmethod
+  def is_large(view):
+    return view.size() > GoToolsSettings.get().large_buffer_threshold
+
+  # Yields the utf-8 encoded text between begin and end in chunks of at most
+  # CHUNK_SIZE characters.
+  @staticmethod
+  def buffer_chunks(view, begin=0, end=None):
+    if end is None:
+      end = view.size()
+    for pt in range(begin, end, Buffers.CHUNK_SIZE):
+      yield view.substr(sublime.Region(pt, min(pt + Buffers.CHUNK_SIZE, end))).encode('utf-8')
+
+  # The view's content in the form ToolRunner accepts as stdin: bytes for
+  # ordinary buffers, or a chunk generator for large ones so the encoded
+  # buffer is never held in memory all at once.
+  @staticmethod
+  def buffer_stdin(view):
+    if Buffers.is_large(view):
+      Logger.log("streaming large buffer ({0} characters) in chunks".format(view.size()))
+      return Buffers.buffer_chunks(view)
+    return Buffers.buffer_text(view)
+
   @staticmethod
   def offset_at_cursor(view):
     begin_row, begin_col = view.rowcol(view.sel()[0].begin())
@@ -42,6 +85,15 @@ class Buffers():
     offset = Buffers.offset_at_row_col(view, row, col)
     return (view.file_name(), row, col, offset)
 
+  # Sets the gutter marks used for errors on each 1-based row in rows,
+  # replacing any previous marks stored under key.
+  @staticmethod
+  def mark_error_rows(view, key, rows):
+    view.erase_regions(key)
+    marks = [sublime.Region(view.text_point(row-1, 0)) for row in rows]
+    if len(marks) > 0:
+      view.add_regions(key, marks, "mark", "dot", sublime.DRAW_STIPPLED_UNDERLINE | sublime.PERSISTENT)
+
 class GoBuffers():
   @staticmethod
   def func_name_at_cursor(view):
@@ -62,6 +114,201 @@ class GoBuffers():
   def is_go_source(view):
     return view.score_selector(0, 'source.go') != 0
 
+# Reads the build constraints of Go files: `// +build` lines in the leading
+# comment block and _GOOS/_GOARCH filename suffixes. Only the header of each
+# file is read. Files on disk are indexed per package, recording the tags each
+# file needs on its own (files with mutually exclusive constraints such as
+# `integration` and `!integration` are common, so the sets are never merged),
+# and the index is cached until a file in the package changes.
+class BuildConstraints():
+  KNOWN_OS = ["android", "darwin", "dragonfly", "freebsd", "linux", "nacl", "netbsd",
+    "openbsd", "plan9", "solaris", "windows"]
+  KNOWN_ARCH = ["386", "amd64", "amd64p32", "arm", "arm64", "ppc64", "ppc64le",
+    "mips", "mipsle", "mips64", "mips64le", "s390x"]
+  RELEASE_TAGS = ["cgo", "gc", "gccgo"]
+
+  lock = threading.Lock()
+  # path -> (mtime, parsed constraint lines)
+  cache = {}
+  # package dir -> (stamp, {filename: tags, or None if it can't be built})
+  packages = {}
+
+  # Parses the `+build` lines of a header into a list of constraint lines.
+  # Lines are ANDed; each line is a list of space-separated alternatives,
+  # each of which is a list of comma-separated (negated, tag) factors.
+  @staticmethod
+  def parse_header(lines):
+    constraints = []
+    for line in lines:
+      line = line.strip()
+      if len(line) == 0:
+        continue
+      if not line.startswith("//"):
+        break
+      fields = line[2:].split()
+      if len(fields) == 0 or fields[0] != "+build":
+        continue
+      alternatives = []
+      for option in fields[1:]:
+        factors = []
+        for tag in option.split(","):
+          if tag.startswith("!"):
+            factors.append((True, tag[1:]))
+          else:
+            factors.append((False, tag))
+        alternatives.append(factors)
+      constraints.append(alternatives)
+    return constraints
+
+  # Reads the leading comment block of the file at path, stopping at the
+  # first line of code (normally the package clause).
+  @staticmethod
+  def read_header(path):
+    lines = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+      for line in f:
+        stripped = line.strip()
+        if len(stripped) > 0 and not stripped.startswith("//"):
+          break
+        lines.append(line)
+    return lines
+
+  @staticmethod
+  def file_constraints(path):
+    mtime = os.path.getmtime(path)
+    with BuildConstraints.lock:
+      cached = BuildConstraints.cache.get(path)
+    if cached and cached[0] == mtime:
+      return cached[1]
+    constraints = BuildConstraints.parse_header(BuildConstraints.read_header(path))
+    with BuildConstraints.lock:
+      BuildConstraints.cache[path] = (mtime, constraints)
+    return constraints
+
+  # Like file_constraints, but reads the header lines from the view so that
+  # unsaved changes are seen.
+  @staticmethod
+  def view_constraints(view):
+    lines = []
+    pt = 0
+    while pt < view.size():
+      region = view.full_line(pt)
+      line = view.substr(region)
+      stripped = line.strip()
+      if len(stripped) > 0 and not stripped.startswith("//"):
+        break
+      lines.append(line)
+      pt = region.end()
+    return BuildConstraints.parse_header(lines)
+
+  # Whether filename's _GOOS/_GOARCH suffixes (if any) match goos and goarch.
+  @staticmethod
+  def matches_filename(filename, goos, goarch):
+    name = os.path.splitext(os.path.basename(filename))[0]
+    if name.endswith("_test"):
+      name = name[:-len("_test")]
+    parts = name.split("_")[1:]
+    if len(parts) >= 2 and parts[-2] in BuildConstraints.KNOWN_OS and parts[-1] in BuildConstraints.KNOWN_ARCH:
+      return parts[-2] == goos and parts[-1] == goarch
+    if len(parts) >= 1 and parts[-1] in BuildConstraints.KNOWN_OS:
+      return parts[-1] == goos
+    if len(parts) >= 1 and parts[-1] in BuildConstraints.KNOWN_ARCH:
+      return parts[-1] == goarch
+    return True
+
+  # Returns the custom tags needed to satisfy constraints on goos/goarch, or
+  # None if they can't be satisfied (e.g. `+build windows` on linux, or
+  # `+build ignore`). For each line the first satisfiable alternative wins.
+  @staticmethod
+  def required_tags(constraints, goos, goarch):
+    tags = []
+    for alternatives in constraints:
+      satisfied = False
+      for factors in alternatives:
+        option_tags = []
+        for negated, tag in factors:
+          if BuildConstraints.is_implicit(tag):
+            ok = BuildConstraints.implicit_value(tag, goos, goarch) != negated
+          elif tag == "ignore":
+            ok = negated
+          else:
+            ok = True
+            if not negated:
+              option_tags.append(tag)
+          if not ok:
+            break
+        else:
+          satisfied = True
+          tags += [t for t in option_tags if t not in tags]
+          break
+      if not satisfied:
+        return None
+    return tags
+
+  @staticmethod
+  def is_implicit(tag):
+    return (tag in BuildConstraints.KNOWN_OS or tag in BuildConstraints.KNOWN_ARCH
+      or tag in BuildConstraints.RELEASE_TAGS or tag.startswith("go1."))
+
+  @staticmethod
+  def implicit_value(tag, goos, goarch):
+    if tag in BuildConstraints.KNOWN_OS:
+      return tag == goos
+    if tag in BuildConstraints.KNOWN_ARCH:
+      return tag == goarch
+    return tag != "gccgo"
+
+  # Returns the tags needed to build the file shown in view, including
+  # unsaved changes to its header.
+  @staticmethod
+  def tags_for_view(view):
+    goos = GoToolsSettings.get().goos
+    goarch = GoToolsSettings.get().goarch
+    if view.file_name() and not BuildConstraints.matches_filename(view.file_name(), goos, goarch):
+      return []
+    tags = BuildConstraints.required_tags(BuildConstraints.view_constraints(view), goos, goarch)
+    return tags or []
+
+  # Returns the tags needed to build the Go file at path, as saved on disk,
+  # from the index of its package.
+  @staticmethod
+  def tags_for_file(path):
+    tags = BuildConstraints.package_index(os.path.dirname(path)).get(os.path.basename(path))
+    return tags or []
+
+  # Returns {filename: tags} for the Go files in pkg_dir, where tags are the
+  # custom tags that file needs on the current GOOS/GOARCH, or None if it
+  # can't be built there.
+  @staticmethod
+  def package_index(pkg_dir):
+    goos = GoToolsSettings.get().goos
+    goarch = GoToolsSettings.get().goarch
+    try:
+      filenames = sorted(f for f in os.listdir(pkg_dir) if f.endswith(".go") and not f.startswith(".") and not f.startswith("_"))
+      stamp = (goos, goarch, os.path.getmtime(pkg_dir)) + tuple(os.path.getmtime(os.path.join(pkg_dir, f)) for f in filenames)
+    except OSError as e:
+      Logger.log("couldn't index build constraints of {0}: {1}".format(pkg_dir, str(e)))
+      return {}
+
+    with BuildConstraints.lock:
+      cached = BuildConstraints.packages.get(pkg_dir)
+    if cached and cached[0] == stamp:
+      return cached[1]
+
+    index = {}
+    for filename in filenames:
+      if not BuildConstraints.matches_filename(filename, goos, goarch):
+        index[filename] = None
+        continue
+      try:
+        constraints = BuildConstraints.file_constraints(os.path.join(pkg_dir, filename))
+      except OSError:
+        continue
+      index[filename] = BuildConstraints.required_tags(constraints, goos, goarch)
+    with BuildConstraints.lock:
+      BuildConstraints.packages[pkg_dir] = (stamp, index)
+    return index
+
 class Logger():
   @staticmethod
   def log(msg):
@@ -76,49 +323,83 @@ class Logger():
   def status(msg):
     sublime.status_message("GoTools: " + msg)
 
-class ToolRunner():
+# Logs the peak memory allocated by Python while the block runs, when
+# debugging is enabled. tracemalloc needs Python 3.4, so on Sublime Text 3's
+# Python 3.3 this falls back to the process's peak resident set size, which
+# shows how far (if at all) the block raised the high-water mark. Neither is
+# available on Windows under Python 3.3, where nothing is logged.
+class MemoryTrace():
+  def __init__(self, name):
+    self.name = name
+    self.started = False
+
+  def __enter__(self):
+    self.enabled = GoToolsSettings.get().debug_enabled
+    if self.enabled and tracemalloc is not None:
+      if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        self.started = True
+      self.base = tracemalloc.get_traced_memory()[0]
+      if hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    elif self.enabled and resource is not None:
+      self.base = MemoryTrace.max_rss()
+    return self
+
+  def __exit__(self, *exc):
+    if self.enabled and tracemalloc is not None:
+      peak = tracemalloc.get_traced_memory()[1] - self.base
+      Logger.log("{0}: peak memory {1:.1f} KB".format(self.name, peak / 1024.0))
+      if self.started:
+        tracemalloc.stop()
+    elif self.enabled and resource is not None:
+      peak = MemoryTrace.max_rss()
+      Logger.log("{0}: peak process memory {1:.1f} KB (+{2:.1f} KB)".format(self.name, peak / 1024.0, (peak - self.base) / 1024.0))
+    return False
+
+  # Peak resident set size of the process in bytes. Linux reports
+  # ru_maxrss in kilobytes, OS X in bytes.
   @staticmethod
-  def run(tool, args=[], stdin=None, timeout=5):
-    toolpath = None
-    searchpaths = list(map(lambda x: os.path.join(x, 'bin'), GoToolsSettings.get().gopath.split(os.pathsep)))
-    for p in GoToolsSettings.get().ospath.split(os.pathsep):
-      searchpaths.append(p)
-    searchpaths.append(os.path.join(GoToolsSettings.get().goroot, 'bin'))
-    searchpaths.append(GoToolsSettings.get().gorootbin)
+  def max_rss():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == "Darwin":
+      return rss
+    return rss * 1024
 
-    if platform.system() == "Windows":
-      tool = tool + ".exe"
+class ToolRunner():
+  BELOW_NORMAL_PRIORITY_CLASS = 0x00004000
+  CREATE_NEW_PROCESS_GROUP = 0x00000200
 
-    for path in searchpaths:
-      candidate = os.path.join(path, tool)
-      if os.path.isfile(candidate):
-        toolpath = candidate
-        break
+  # Streams which are still running, so they can be cancelled from the UI.
+  active = set()
+  active_lock = threading.Lock()
+  # (tool, search paths) -> resolved tool path
+  tool_paths = {}
 
-    if not toolpath:
-      Logger.log("Couldn't find Go tool '{0}' in:\n{1}".format(tool, "\n".join(searchpaths)))
-      raise Exception("Error running Go tool '{0}'; check the console logs for details".format(tool))
+  # Runs tool to completion and returns its stdout, stderr and return code.
+  # stdin may be bytes or an iterable of byte chunks (see
+  # Buffers.buffer_stdin). Pass decode=False to get stdout as bytes, e.g. to
+  # feed it to another tool without a round trip through str.
+  @staticmethod
+  def run(tool, args=[], stdin=None, timeout=5, decode=True):
+    if stdin is not None and not isinstance(stdin, bytes):
+      stream = ToolRunner.stream(tool, args, stdin=stdin, timeout=timeout)
+      stdout = stream.read_bytes()
+      if stream.timed_out:
+        raise subprocess.TimeoutExpired(stream.name, timeout)
+      return stdout.decode("utf-8") if decode else stdout, stream.stderr, stream.returncode
 
-    cmd = [toolpath] + args
+    cmd = [ToolRunner.find_tool(tool)] + args
     try:
       Logger.log("spawning process...")
 
-      env = os.environ.copy()
-      env["PATH"] = GoToolsSettings.get().ospath
-      env["GOPATH"] = GoToolsSettings.get().gopath
-      env["GOROOT"] = GoToolsSettings.get().goroot
+      env = ToolRunner.env()
 
       Logger.log("\tcommand:     " + " ".join(cmd))
       Logger.log("\tenvironment: " + str(env))
 
-      # Hide popups on Windows
-      si = None
-      if platform.system() == "Windows":
-        si = subprocess.STARTUPINFO()
-        si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-
       start = time.time()
-      p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, startupinfo=si)
+      p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, startupinfo=ToolRunner.startupinfo())
       stdout, stderr = p.communicate(input=stdin, timeout=timeout)
       p.wait(timeout=timeout)
       elapsed = round(time.time() - start)
@@ -126,6 +407,247 @@ class ToolRunner():
       stderr = stderr.decode("utf-8")
       if len(stderr) > 0:
         Logger.log("stderr:\n{0}".format(stderr))
-      return stdout.decode("utf-8"), stderr, p.returncode
+      return stdout.decode("utf-8") if decode else stdout, stderr, p.returncode
     except subprocess.CalledProcessError as e:
       raise
+
+  # Starts tool and returns a ToolStream which yields its output lines as they
+  # are produced. The process is killed if it runs longer than timeout
+  # seconds or if the stream is cancelled. Background work should pass
+  # low_priority so the tool yields the CPU to interactive requests.
+  @staticmethod
+  def stream(tool, args=[], stdin=None, timeout=None, merge_stderr=False, low_priority=False, cwd=None):
+    cmd = [ToolRunner.find_tool(tool)] + args
+    env = ToolRunner.env()
+
+    Logger.log("spawning streaming process...")
+    Logger.log("\tcommand:     " + " ".join(cmd))
+    Logger.log("\tenvironment: " + str(env))
+
+    # Each tool gets its own process group so that cancelling it also kills
+    # whatever it started, e.g. the test binaries run by `go test`.
+    if platform.system() == "Windows":
+      popen_opts = {"creationflags": ToolRunner.CREATE_NEW_PROCESS_GROUP}
+      if low_priority:
+        popen_opts["creationflags"] |= ToolRunner.BELOW_NORMAL_PRIORITY_CLASS
+    else:
+      popen_opts = {"start_new_session": True}
+      if low_priority:
+        popen_opts["preexec_fn"] = lambda: os.nice(10)
+
+    stderr = subprocess.STDOUT if merge_stderr else subprocess.PIPE
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr, env=env, cwd=cwd, startupinfo=ToolRunner.startupinfo(), **popen_opts)
+    return ToolStream(p, " ".join([tool] + args), stdin, timeout)
+
+  # Cancels every in-flight ToolStream. Returns the number cancelled.
+  @staticmethod
+  def cancel_all():
+    with ToolRunner.active_lock:
+      streams = list(ToolRunner.active)
+    for s in streams:
+      s.cancel()
+    return len(streams)
+
+  # Returns the absolute path of tool, searching GOPATH, PATH and GOROOT.
+  # Resolved paths are cached for as long as the search path is unchanged.
+  @staticmethod
+  def find_tool(tool):
+    searchpaths = list(map(lambda x: os.path.join(x, 'bin'), GoToolsSettings.get().gopath_entries))
+    for p in GoToolsSettings.get().ospath.split(os.pathsep):
+      searchpaths.append(p)
+    searchpaths.append(os.path.join(GoToolsSettings.get().goroot, 'bin'))
+    searchpaths.append(GoToolsSettings.get().gorootbin)
+
+    if platform.system() == "Windows":
+      tool = tool + ".exe"
+
+    key = (tool, tuple(searchpaths))
+    toolpath = ToolRunner.tool_paths.get(key)
+    if toolpath and os.path.isfile(toolpath):
+      return toolpath
+
+    for path in searchpaths:
+      candidate = os.path.join(path, tool)
+      if os.path.isfile(candidate):
+        ToolRunner.tool_paths[key] = candidate
+        return candidate
+
+    Logger.log("Couldn't find Go tool '{0}' in:\n{1}".format(tool, "\n".join(searchpaths)))
+    raise Exception("Error running Go tool '{0}'; check the console logs for details".format(tool))
+
+  @staticmethod
+  def env():
+    env = os.environ.copy()
+    env["PATH"] = GoToolsSettings.get().ospath
+    env["GOPATH"] = GoToolsSettings.get().gopath
+    env["GOROOT"] = GoToolsSettings.get().goroot
+    return env
+
+  # Hide popups on Windows
+  @staticmethod
+  def startupinfo():
+    si = None
+    if platform.system() == "Windows":
+      si = subprocess.STARTUPINFO()
+      si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return si
+
+# A running tool process whose stdout is consumed line by line. Iterating the
+# stream yields decoded lines (including line endings) as the tool writes
+# them; once iteration finishes, returncode and stderr are available.
+class ToolStream():
+  def __init__(self, process, name, stdin=None, timeout=None):
+    self.process = process
+    self.name = name
+    self.returncode = None
+    self.cancelled = False
+    self.timed_out = False
+    self.start = time.time()
+    self.stderr_lines = []
+
+    with ToolRunner.active_lock:
+      ToolRunner.active.add(self)
+
+    # Feed stdin and drain stderr on their own threads so a tool blocked on
+    # one pipe can't stall the others.
+    self.threads = [threading.Thread(target=self.write_stdin, args=(stdin,))]
+    if process.stderr:
+      self.threads.append(threading.Thread(target=self.read_stderr))
+    for t in self.threads:
+      t.start()
+
+    self.timer = None
+    if timeout:
+      self.timer = threading.Timer(timeout, self.expire)
+      self.timer.start()
+
+  def __iter__(self):
+    try:
+      for line in iter(self.process.stdout.readline, b''):
+        yield line.decode("utf-8", errors="replace")
+    finally:
+      self.wait()
+
+  @property
+  def stderr(self):
+    return "".join(self.stderr_lines)
+
+  # Reads the remaining output and returns it as a single string.
+  def read(self):
+    return "".join(self)
+
+  # Reads the remaining output undecoded.
+  def read_bytes(self):
+    try:
+      return self.process.stdout.read()
+    finally:
+      self.wait()
+
+  def wait(self):
+    if self.returncode is not None:
+      return self.returncode
+    self.process.stdout.close()
+    self.returncode = self.process.wait()
+    for t in self.threads:
+      t.join()
+    if self.timer:
+      self.timer.cancel()
+    with ToolRunner.active_lock:
+      ToolRunner.active.discard(self)
+    elapsed = round(time.time() - self.start, 1)
+    Logger.log("process '{0}' returned ({1}) in {2} seconds".format(self.name, str(self.returncode), str(elapsed)))
+    if len(self.stderr_lines) > 0:
+      Logger.log("stderr:\n{0}".format(self.stderr))
+    return self.returncode
+
+  def cancel(self):
+    if self.process.poll() is None:
+      Logger.log("cancelling process '{0}'".format(self.name))
+      self.cancelled = True
+      self.kill()
+
+  def expire(self):
+    if self.process.poll() is None:
+      Logger.log("process '{0}' timed out".format(self.name))
+      self.timed_out = True
+      self.kill()
+
+  # Kills the process group started by ToolRunner.stream. Killing only the
+  # tool would leave its children running and holding the output pipe open.
+  def kill(self):
+    try:
+      if platform.system() == "Windows":
+        subprocess.call(["taskkill", "/F", "/T", "/PID", str(self.process.pid)],
+          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, startupinfo=ToolRunner.startupinfo())
+      else:
+        os.killpg(self.process.pid, signal.SIGKILL)
+    except OSError as e:
+      Logger.log("couldn't kill process group of '{0}': {1}".format(self.name, str(e)))
+      self.process.kill()
+
+  def write_stdin(self, stdin):
+    try:
+      if isinstance(stdin, bytes):
+        self.process.stdin.write(stdin)
+      elif stdin is not None:
+        for chunk in stdin:
+          self.process.stdin.write(chunk)
+      self.process.stdin.close()
+    except OSError:
+      # The process exited (or was killed) before consuming its input.
+      pass
+
+  def read_stderr(self):
+    for line in iter(self.process.stderr.readline, b''):
+      self.stderr_lines.append(line.decode("utf-8", errors="replace"))
+    self.process.stderr.close()
+
+# An output panel which is filled incrementally while a tool runs. Appends
+# are batched so a chatty tool doesn't flood the UI with edits.
+class OutputPanel():
+  FLUSH_INTERVAL = 0.1
+
+  def __init__(self, window, name, regex=None):
+    self.window = window
+    self.name = name
+    self.view = window.create_output_panel(name)
+    self.view.set_scratch(True)
+    if regex:
+      self.view.settings().set("result_file_regex", regex)
+    self.view.run_command("select_all")
+    self.view.run_command("right_delete")
+    self.pending = []
+    self.last_flush = time.time()
+
+  def show(self):
+    self.window.run_command("show_panel", {"panel": "output." + self.name})
+
+  def append(self, text):
+    self.pending.append(text)
+    if time.time() - self.last_flush >= OutputPanel.FLUSH_INTERVAL:
+      self.flush()
+
+  def flush(self):
+    self.last_flush = time.time()
+    if len(self.pending) == 0:
+      return
+    text = "".join(self.pending)
+    self.pending = []
+    self.view.run_command('append', {'characters': text, 'force': True, 'scroll_to_end': True})
+
+  # Appends each line of a ToolStream as it arrives. Returns the number of
+  # lines appended.
+  def follow(self, stream):
+    count = 0
+    for line in stream:
+      self.append(line)
+      count += 1
+    self.flush()
+    return count
+
+class GotoolsCancelCommand(sublime_plugin.WindowCommand):
+  def run(self):
+    cancelled = ToolRunner.cancel_all()
+    # Builds and tests run through Sublime's exec command.
+    self.window.run_command("exec", {"kill": True})
+    Logger.status("cancelled {0} running tool(s)".format(cancelled))
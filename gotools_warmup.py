@@ -0,0 +1,45 @@
+import threading
+import time
+
+from .gotools_suggestions import GotoolsSuggestions
+from .gotools_util import Logger
+from .gotools_util import ToolRunner
+from .gotools_settings import GoToolsSettings
+
+# Pays the one-time startup costs (settings and environment initialization,
+# tool path resolution and gocode startup) on a background thread as soon as
+# the plugin loads, rather than on the first GoTools action. Anything that
+# needs settings in the meantime blocks on the settings lock until the
+# warm-up has initialized them, instead of initializing them again.
+class Warmup():
+  @staticmethod
+  def run():
+    start = time.time()
+    try:
+      settings = GoToolsSettings.get()
+      for tool in Warmup.configured_tools(settings):
+        try:
+          ToolRunner.find_tool(tool)
+        except Exception:
+          Logger.log("warm-up couldn't resolve tool '{0}'".format(tool))
+      if settings.autocomplete:
+        GotoolsSuggestions.set_lib_path()
+    except Exception as e:
+      Logger.error("warm-up failed: " + str(e))
+    print("GoTools: warm-up finished in {0} seconds".format(round(time.time() - start, 2)))
+
+  @staticmethod
+  def configured_tools(settings):
+    tools = ["go", "gorename", "oracle"]
+    if settings.format_backend in ["gofmt", "both"]:
+      tools.append("gofmt")
+    if settings.format_backend in ["goimports", "both"]:
+      tools.append("goimports")
+    if settings.goto_def_backend == "godef":
+      tools.append("godef")
+    if settings.autocomplete:
+      tools.append("gocode")
+    return tools
+
+def plugin_loaded():
+  threading.Thread(target=Warmup.run).start()
@@ -0,0 +1,122 @@
+import sublime
+import sublime_plugin
+import threading
+import time
+
+from .gotools_build import GotoolsBuildCommand
+from .gotools_util import GoBuffers
+from .gotools_util import Logger
+from .gotools_util import OutputPanel
+from .gotools_util import ToolRunner
+from .gotools_settings import GoToolsSettings
+
+# Re-runs the last test selection of a window whenever a file in one of the
+# tested packages is saved. Saves are debounced by test_watch_delay, and a
+# newer save kills the run in flight so results never queue up behind stale
+# ones.
+class TestWatcher():
+  STATUS_KEY = "gotools_test_watch"
+
+  lock = threading.Lock()
+  # window id -> TestWatcher
+  watchers = {}
+
+  def __init__(self, window):
+    self.window = window
+    self.generation = 0
+    self.stream = None
+    self.status = "tests: watching"
+
+  def on_save(self, view):
+    last = GotoolsBuildCommand.last_tests.get(self.window.id())
+    if not last:
+      return
+    cmd, packages = last
+    if GotoolsBuildCommand.current_file_pkg(view) not in packages:
+      return
+
+    with TestWatcher.lock:
+      self.generation += 1
+      generation = self.generation
+      stream = self.stream
+    if stream:
+      stream.cancel()
+    sublime.set_timeout(lambda: self.start(cmd, generation), GoToolsSettings.get().test_watch_delay)
+
+  def start(self, cmd, generation):
+    if generation != self.generation:
+      return
+    threading.Thread(target=self.run_tests, args=(cmd, generation)).start()
+
+  def run_tests(self, cmd, generation):
+    with TestWatcher.lock:
+      if generation != self.generation:
+        return
+      try:
+        # cmd starts with the absolute path of the go binary.
+        self.stream = ToolRunner.stream("go", cmd[1:], merge_stderr=True)
+      except Exception as e:
+        Logger.error("couldn't run tests: " + str(e))
+        return
+      stream = self.stream
+
+    self.set_status("tests: running...")
+    start = time.time()
+    panel = OutputPanel(self.window, 'gotools_test_watch', "^\\s*(.*\\.go):(\\d+):()(.*)$")
+    panel.follow(stream)
+    if stream.cancelled:
+      return
+
+    elapsed = time.time() - start
+    if stream.returncode == 0:
+      self.set_status("tests: PASS ({0:.1f}s)".format(elapsed))
+    else:
+      self.set_status("tests: FAIL ({0:.1f}s)".format(elapsed))
+      panel.show()
+
+  def set_status(self, status):
+    self.status = status
+    sublime.set_timeout(self.show_status, 0)
+
+  def show_status(self):
+    for view in self.window.views():
+      view.set_status(TestWatcher.STATUS_KEY, self.status)
+
+  def stop(self):
+    with TestWatcher.lock:
+      self.generation += 1
+      stream = self.stream
+    if stream:
+      stream.cancel()
+    for view in self.window.views():
+      view.erase_status(TestWatcher.STATUS_KEY)
+
+class GotoolsToggleTestWatchCommand(sublime_plugin.WindowCommand):
+  def run(self):
+    watcher = TestWatcher.watchers.pop(self.window.id(), None)
+    if watcher:
+      watcher.stop()
+      Logger.status("test watch disabled")
+      return
+    if self.window.id() not in GotoolsBuildCommand.last_tests:
+      Logger.status("run a test first; watch mode re-runs the last test on save")
+      return
+    watcher = TestWatcher(self.window)
+    TestWatcher.watchers[self.window.id()] = watcher
+    watcher.show_status()
+    Logger.status("test watch enabled")
+
+  def is_checked(self):
+    return self.window.id() in TestWatcher.watchers
+
+class GotoolsTestWatch(sublime_plugin.EventListener):
+  def on_post_save_async(self, view):
+    if not GoBuffers.is_go_source(view): return
+    watcher = TestWatcher.watchers.get(view.window().id()) if view.window() else None
+    if watcher:
+      watcher.on_save(view)
+
+  def on_activated(self, view):
+    watcher = TestWatcher.watchers.get(view.window().id()) if view.window() else None
+    if watcher:
+      view.set_status(TestWatcher.STATUS_KEY, watcher.status)